@@ -2,10 +2,7 @@ from tkinter import messagebox
 from tkinter import *
 from customtkinter import *
 
-import numpy as np
-import matplotlib.pyplot as plt
-
-from scipy.integrate import odeint
+from orbit_tasks import OrbitPlot, OrbitWorker, read_params
 
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import (
@@ -116,85 +113,10 @@ def graph():
                   validatecommand=(validation, '%S'))
     te.grid(row=0, column=11, padx=5)
 
-    def CRTBP(te, x, y, vx, vy, mu, canvas, ax):
-        ax.clear()
-        try:
-            t = float(te.get())
-            x = float(x.get())
-            y = float(y.get())
-            vx = float(vx.get())
-            vy = float(vy.get())
-            mu = float(mu.get())
-            Y0 = np.array([x, y, 0, vx, vy, 0])
-        except:
-            messagebox.showerror(
-                'Missing Value', 'Some value not well defined')
-
-        def equation(Y, t, mu):
-
-            x, y, z, vx, vy, vz = Y
-            mu1 = 1-mu
-            mu2 = mu
-            r1 = np.sqrt((x+mu2)**2 + y**2+z**2)
-            r2 = np.sqrt((x-mu1)**2 + y**2+z**2)
-
-            mu_r1 = mu1/(r1**3)
-            mu_r2 = mu2/(r2**3)
-
-            ax = 2*vy+x-(x+mu2)*mu_r1-(x-mu1)*mu_r2
-            ay = -2*vx+y - (mu_r1+mu_r2)*y
-            az = -(mu_r1+mu_r2)*z
-
-            return [vx, vy, vz, ax, ay, az]
-
-        ts = np.linspace(0, t, int(1e5))
-
-        Y_rotational = odeint(equation, y0=Y0, t=ts,
-                              atol=1e-10, rtol=1e-10, mxstep=1000, args=(mu,))
-
-        mu1 = 1-mu
-        mu2 = mu
-
-        r1 = np.sqrt((x+mu2)**2+y**2)
-        r2 = np.sqrt((x-mu1)**2+y**2)
-
-        cj = x**2+y**2+2*(mu1/r1+mu2/r2)-vx**2-vy**2
-        if surfacevar.get():
-
-            x = np.linspace(-2, 2, 100)
-            y = np.linspace(-2, 2, 100)
-
-            X, Y = np.meshgrid(x, y)
-            r1 = np.sqrt((X+mu2)**2+Y**2)
-            r2 = np.sqrt((X-mu1)**2+Y**2)
-
-            Cj = X**2+Y**2+2*(mu1/r1+mu2/r2)
-            try:
-                ax.contour(X, Y, Cj, levels=[cj], colors='gray')
-            except:
-                messagebox.showinfo('Orbit Info', 'The Orbit is Unbounded')
-        if lagrangevar.get():
-            alpha = (mu2/(3*mu1))**(1/3)
-            L1 = mu1 - (alpha - (alpha**2)/3 -
-                        (alpha**3)/9-(alpha**4)*(23/81))
-            L2 = mu1 + (alpha + (alpha**2)/3 -
-                        (alpha**3)/9-(alpha**4)*(31/81))
-            ax.plot(L1, 0, 'b+')
-            ax.plot(L2, 0, 'b+')
-            if Y_rotational[:, 0].min() < 0:
-                mu2mu1 = mu2/mu1
-                L3 = -mu2 - 1 - (-(7/12)*(mu2mu1)+(7/12) *
-                                 ((mu2mu1)**2) - (13223/20736)*((mu2mu1)**3))
-                ax.plot(L3, 0, 'b+')
-        ax.plot(Y_rotational[:, 0], Y_rotational[:, 1])
-        ax.plot(-mu, 0, 'ro')
-        ax.plot(1-mu, 0, 'bo')
-        ax.axis('equal')
-        canvas.draw()
-        return Y_rotational
-
     fig = Figure(figsize=(5, 4))
     ax = fig.add_subplot(111)
+    # Artists are created once and only their data change between orbits
+    orbit_plot = OrbitPlot(ax)
 
     canvas = FigureCanvasTkAgg(fig, master=win)  # A tk.DrawingArea.
     canvas.draw()
@@ -204,10 +126,54 @@ def graph():
     toolbar.update()
     canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=1)
 
+    progressbar = CTkProgressBar(Settings)
+    progressbar.set(0)
+    progressbar.grid(row=2, column=0, pady=20)
+
+    # The integration runs in a thread, the window polls it every 50 ms
+    worker = OrbitWorker()
+
+    def poll():
+        state = worker.poll()
+        progressbar.set(worker.progress)
+        if state is None or state[0] == 'progress':
+            win.after(50, poll)
+            return
+        kind, value = state
+        plotbutton.configure(state=NORMAL)
+        if kind == 'done':
+            if not orbit_plot.update(value):
+                messagebox.showinfo('Orbit Info', 'The Orbit is Unbounded')
+            canvas.draw_idle()
+        elif kind == 'error':
+            messagebox.showerror('Integration error', str(value))
+
+    def CRTBP(te, x, y, vx, vy, mu):
+        params = dict(t=te.get(), x=x.get(), y=y.get(), vx=vx.get(), vy=vy.get(), mu=mu.get(),
+                      lagrange=lagrangevar.get(), surface=surfacevar.get())
+        try:
+            read_params(params)
+        except ValueError:
+            messagebox.showerror(
+                'Missing Value', 'Some value not well defined')
+            return
+        plotbutton.configure(state=DISABLED)
+        worker.start(params)
+        win.after(50, poll)
+
+    def close():
+        worker.cancel()
+        win.destroy()
+
+    win.protocol('WM_DELETE_WINDOW', close)
+
     plotbutton = CTkButton(options_graph, text='PLOT',
-                           command=lambda x=x, y=y, vx=vx, vy=vy, te=te, mu=mu: CRTBP(te, x, y, vx, vy, mu, canvas, ax))
+                           command=lambda x=x, y=y, vx=vx, vy=vy, te=te, mu=mu: CRTBP(te, x, y, vx, vy, mu))
     plotbutton.grid(row=0, column=12, padx=5)
 
+    cancelbutton = CTkButton(Settings, text='Cancel', command=worker.cancel)
+    cancelbutton.grid(row=3, column=0, pady=20)
+
 
 orbits_button = CTkButton(buttons_frame, width=200, height=80, text='Graph orbit', command=graph,
                           corner_radius=10, bg_color="transparent", fg_color="#3CC2E3")
@@ -0,0 +1,214 @@
+"""
+Computations of gui.py, independent of Tk.
+
+integrate() propagates an orbit in chunks so that it can report its
+progress and be cancelled. OrbitWorker runs it in a background thread for
+the GUI, and OrbitPlot keeps the matplotlib artists of a figure so that new
+orbits only update their data. Run as a script, the same computations are
+done in batch from a parameter file:
+
+    python orbit_tasks.py runs.json --output results
+
+where runs.json holds a list of runs such as
+    [{"mu": 0.0121437, "x": 0.5, "y": 0, "vx": 0, "vy": 1.2, "t": 20,
+      "lagrange": true, "surface": true}]
+
+The equations of motion, Jacobi constant and Lagrange points are those of
+Crtbp (crtbp.py in the parent directory).
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crtbp import Crtbp
+
+
+class Cancelled(Exception):
+    pass
+
+
+def read_params(params):
+    """Initial state and parameters of a run from a dict of numbers or strings"""
+    try:
+        values = {key: float(params[key]) for key in ['mu', 'x', 'y', 'vx', 'vy', 't']}
+    except (KeyError, ValueError):
+        raise ValueError('Some value not well defined')
+    values['lagrange'] = bool(params.get('lagrange', False))
+    values['surface'] = bool(params.get('surface', False))
+    values['n_points'] = int(params.get('n_points', 1e5))
+    return values
+
+
+def integrate(params, n_chunks=50, progress=None, cancel=None):
+    """Orbit of a run, integrated in n_chunks pieces
+
+    Args:
+        params (dict): mu, x, y, vx, vy, t (see read_params)
+        n_chunks (int): number of pieces, progress and cancel are checked
+            between pieces
+        progress (callable): called with the fraction of the integration done
+        cancel (threading.Event): stops the integration (raises Cancelled)
+
+    Returns:
+        result (dict): params plus 'ts' and 'Y' (n_points,6), the Jacobi
+            constant 'cj' and the wall time 'elapsed'
+    """
+    p = read_params(params)
+    start = time.perf_counter()
+    system = Crtbp(np.array([p['x'], p['y'], 0, p['vx'], p['vy'], 0]), p['mu'])
+    n = p['n_points']
+    chunk = -(-n//n_chunks)
+
+    ts = np.empty(n)
+    Y = np.empty((n, 6))
+    i = 0
+    for X, T in system.propagate_stream(p['t'], n, chunk=chunk):
+        if cancel is not None and cancel.is_set():
+            raise Cancelled()
+        ts[i:i+len(T)] = T
+        Y[i:i+len(T)] = X.T
+        i += len(T)
+        if progress is not None:
+            progress(i/n)
+
+    return dict(p, ts=ts, Y=Y, cj=system.jacobi, elapsed=time.perf_counter() - start)
+
+
+class OrbitWorker():
+    """
+    Runs integrate in a background thread. The GUI polls the worker (e.g.
+    with root.after) instead of waiting, so the window stays responsive.
+    """
+    def __init__(self):
+        self.thread = None
+        self.cancel_event = threading.Event()
+        self.messages = queue.Queue()
+        self.progress = 0.0
+
+    @property
+    def busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, params):
+        if self.busy:
+            self.cancel()
+            self.thread.join()
+        self.cancel_event = threading.Event()
+        self.messages = queue.Queue()
+        self.progress = 0.0
+        self.thread = threading.Thread(target=self._run, args=(params, self.cancel_event, self.messages),
+                                       daemon=True)
+        self.thread.start()
+
+    def _run(self, params, cancel, messages):
+        try:
+            result = integrate(params, progress=lambda f: messages.put(('progress', f)),
+                               cancel=cancel)
+            messages.put(('done', result))
+        except Cancelled:
+            messages.put(('cancelled', None))
+        except Exception as error:
+            messages.put(('error', error))
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def poll(self):
+        """Latest state: ('progress', fraction), ('done', result),
+        ('cancelled', None), ('error', exception) or None if nothing new"""
+        state = None
+        while True:
+            try:
+                kind, value = self.messages.get_nowait()
+            except queue.Empty:
+                return state
+            if kind == 'progress':
+                self.progress = value
+            state = (kind, value)
+            if kind != 'progress':
+                return state
+
+
+class OrbitPlot():
+    """
+    Artists of an orbit plot created once; update only changes their data
+    """
+    def __init__(self, ax):
+        self.ax = ax
+        self.orbit, = ax.plot([], [])
+        self.m1, = ax.plot([], [], 'ro')
+        self.m2, = ax.plot([], [], 'bo')
+        self.lagrange, = ax.plot([], [], 'b+', linestyle='none')
+        self.contour = None
+
+    def update(self, result):
+        mu = result['mu']
+        Y = result['Y']
+        self.orbit.set_data(Y[:, 0], Y[:, 1])
+        self.m1.set_data([-mu], [0])
+        self.m2.set_data([1-mu], [0])
+
+        L1, L2, L3 = Crtbp.Lagrange_array(mu)[0, :3, 0]
+        points = [L1, L2] + ([L3] if Y[:, 0].min() < 0 else [])
+        if result['lagrange']:
+            self.lagrange.set_data(points, np.zeros(len(points)))
+        else:
+            self.lagrange.set_data([], [])
+
+        if self.contour is not None:
+            self.contour.remove()
+            self.contour = None
+        bounded = True
+        if result['surface']:
+            x = np.linspace(-2, 2, 100)
+            y = np.linspace(-2, 2, 100)
+
+            X, Y = np.meshgrid(x, y)
+            Cj = Crtbp.get_Jacobi([X, Y, 0, 0, 0, 0], mu)
+            if Cj.min() < result['cj'] < Cj.max():
+                self.contour = self.ax.contour(X, Y, Cj, levels=[result['cj']], colors='gray')
+            else:
+                bounded = False
+
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.ax.axis('equal')
+        return bounded
+
+
+def run_batch(path, output, plot=True):
+    """Integrate the runs of a JSON parameter file, saving .npz (and .png) files in output"""
+    with open(path) as f:
+        runs = json.load(f)
+    os.makedirs(output, exist_ok=True)
+    if plot:
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=(5, 4))
+        orbit_plot = OrbitPlot(fig.add_subplot(111))
+
+    for i, params in enumerate(runs):
+        name = params.get('name', f'run{i:03d}')
+        result = integrate(params, progress=lambda f: print(f'\r{name}: {f:4.0%}', end='', flush=True))
+        print(f'\r{name}: done in {result["elapsed"]:.2f} s')
+        np.savez(os.path.join(output, f'{name}.npz'), ts=result['ts'], Y=result['Y'],
+                 **{key: result[key] for key in ['mu', 'cj']})
+        if plot:
+            if not orbit_plot.update(result):
+                print(f'{name}: the orbit is unbounded')
+            fig.savefig(os.path.join(output, f'{name}.png'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch integration of CRTBP orbits (headless gui.py)')
+    parser.add_argument('params', help='JSON file with a list of runs')
+    parser.add_argument('--output', default='results', help='directory of the results')
+    parser.add_argument('--no-plot', action='store_true', help='do not save the figures')
+    args = parser.parse_args()
+    run_batch(args.params, args.output, plot=not args.no_plot)
@@ -0,0 +1,78 @@
+import time
+
+import numpy as np
+
+from crtbp import Crtbp
+
+
+def timer(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def random_states(n, seed=0):
+    rng = np.random.default_rng(seed)
+    r = rng.uniform(0.3, 0.6, n)
+    X0s = np.zeros((n, 6))
+    X0s[:, 0] = r
+    X0s[:, 4] = (1/np.sqrt(r) - r)*rng.uniform(0.95, 1.05, n)
+    return X0s
+
+
+def bench_ensemble(n=200, t=10, n_eval=100, mu=0.01):
+    """Compare propagate_ensemble against a loop of Crtbp.propagate"""
+    X0s = random_states(n)
+
+    def loop():
+        return np.array([Crtbp(X0, mu).propagate(t, n_eval)[0] for X0 in X0s])
+
+    t_loop, X_loop = timer(loop)
+    t_particle, (X_particle, _) = timer(
+        Crtbp.propagate_ensemble, X0s, mu, t, n_eval)
+    t_shared, (X_shared, _) = timer(
+        Crtbp.propagate_ensemble, X0s, mu, t, n_eval, shared_step=True)
+
+    print(f"propagate_ensemble (N={n}, t={t}, n_eval={n_eval})")
+    print(f"  per-object loop   : {t_loop:8.3f} s")
+    print(f"  per-particle steps: {t_particle:8.3f} s  (x{t_loop/t_particle:.1f})"
+          f"  max diff {np.nanmax(np.abs(X_particle-X_loop)):.1e}")
+    print(f"  shared step       : {t_shared:8.3f} s  (x{t_loop/t_shared:.1f})"
+          f"  max diff {np.nanmax(np.abs(X_shared-X_loop)):.1e}")
+
+
+def bench_frames(n=100000, mu=0.01):
+    """Time the synodic/inertial transformations on a long trajectory"""
+    X = random_states(n).T.copy()
+    T = np.linspace(0, 100, n)
+    out = np.empty_like(X)
+
+    t_syn, _ = timer(Crtbp.Syn2Ine, X, T, mu, out=out)
+    t_ine, _ = timer(Crtbp.Ine2Syn, out, T, out=out)
+    print(f"Syn2Ine / Ine2Syn (N={n})")
+    print(f"  Syn2Ine: {t_syn:8.4f} s")
+    print(f"  Ine2Syn: {t_ine:8.4f} s")
+
+
+def bench_engines(t=200, dt=1000, mu=0.01):
+    """Compare the scipy and jit engines of Crtbp.propagate on a long integration"""
+    system = Crtbp(random_states(1)[0], mu)
+    for method in ["DOP853", "RK4", "RK8"]:
+        system.propagate(1, 10, engine="jit", method=method)
+
+    print(f"Crtbp.propagate engines (t={t}, dt={dt})")
+    t_ref = None
+    for engine, method, h in [("scipy", None, None), ("jit", "DOP853", 1e-3),
+                              ("jit", "RK8", 1e-2), ("jit", "RK4", 1e-3)]:
+        elapsed, (X, _) = timer(system.propagate, t, dt,
+                                engine=engine, method=method, h=h)
+        t_ref = t_ref or elapsed
+        drift = abs(Crtbp.get_Jacobi(X[:, -1], mu) - system.jacobi)
+        print(f"  {engine:5s} {method or '':6s}: {elapsed:8.4f} s"
+              f"  (x{t_ref/elapsed:.1f})  Jacobi drift {drift:.1e}")
+
+
+if __name__ == "__main__":
+    bench_ensemble()
+    bench_frames()
+    bench_engines()
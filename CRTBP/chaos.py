@@ -0,0 +1,196 @@
+"""
+Chaos indicators for the Circular Restricted Three Body Problem.
+
+The variational equations are integrated alongside the Crtbp equations of
+motion (crtbp_jit.variational_equation) to obtain, for every orbit, the
+mean exponential growth factor of nearby orbits (MEGNO), the largest
+Lyapunov exponent and the Fast Lyapunov Indicator (FLI). Orbits are stopped
+at escapes and collisions. Grids of initial conditions (x-CJ or a-e planes)
+are distributed over a process pool, as in sweep and poincare.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.integrate import solve_ivp
+
+import crtbp_jit
+from crtbp import Crtbp
+from sweep import make_grid
+
+# Status of an orbit
+COMPLETED = 0
+ESCAPE = 1
+COLLISION = 2
+CLASSES = {COMPLETED: 'completed', ESCAPE: 'escape', COLLISION: 'collision'}
+
+# Result arrays: name -> dtype
+FIELDS = {
+    'megno': np.float64,
+    'lyapunov': np.float64,
+    'fli': np.float64,
+    't_end': np.float64,
+    'status': np.int8,
+    'timing': np.float64,
+}
+
+
+def initial_variational(X0, delta0=None):
+    """Extended state [X, u, l, Y, W, t] of crtbp_jit.variational_equation at t = 0
+
+    Args:
+        X0 (array): Initial state [x,y,z,vx,vy,vz]
+        delta0 (array): Initial deviation vector (normalized), by default
+            along (1,1,0,1,1,0)
+    """
+    delta0 = np.array([1, 1, 0, 1, 1, 0] if delta0 is None else delta0, dtype=float)
+    Z0 = np.zeros(crtbp_jit.N_VARIATIONAL)
+    Z0[:6] = X0
+    Z0[6:12] = delta0/np.linalg.norm(delta0)
+    return Z0
+
+
+def _variational_scipy(Z0, mu, t, R_escape, R_collision, atol, rtol):
+    def equation(s, Z, mu):
+        dZ = np.empty(crtbp_jit.N_VARIATIONAL)
+        crtbp_jit.variational_equation(Z, mu, dZ)
+        return dZ
+
+    events = [Crtbp.get_event('escape', mu, R_escape, terminal=True),
+              Crtbp.get_event('m1', mu, R_collision, terminal=True),
+              Crtbp.get_event('m2', mu, R_collision, terminal=True)]
+    solution = solve_ivp(equation, t_span=[0, t], y0=Z0, method='DOP853',
+                         atol=atol, rtol=rtol, args=(mu,), events=events)
+    status = COMPLETED
+    if solution.status == 1:
+        status = ESCAPE if len(solution.t_events[0]) else COLLISION
+    elif solution.status < 0:
+        status = COLLISION
+    return solution.y[:, -1], solution.y[12].max(), status
+
+
+def indicators(X0, mu, t, R_escape=5, R_collision=1e-3, delta0=None,
+               atol=1e-10, rtol=1e-10, engine=None):
+    """Chaos indicators of one orbit
+
+    Args:
+        X0 (array): Initial state [x,y,z,vx,vy,vz]
+        mu (float): mass ratio (m2)/(m1+m2)
+        t (float): Time of integration
+        R_escape (float): escape radius around the barycenter
+        R_collision (float): collision radius around m1 and m2
+        delta0 (array): Initial deviation vector (see initial_variational)
+        atol, rtol (float): Absolute and relative tolerances
+        engine (str): "jit" or "scipy", by default "jit" when numba is installed
+
+    Returns:
+        result (dict): 'megno' (mean MEGNO, ~2 for regular orbits and growing
+            linearly for chaotic ones), 'lyapunov' (largest Lyapunov exponent
+            estimate ln|delta|/t), 'fli' (maximum of ln|delta|), 't_end'
+            (time reached) and 'status' (COMPLETED, ESCAPE or COLLISION)
+    """
+    engine = engine or ("jit" if crtbp_jit.AVAILABLE else "scipy")
+    Z0 = initial_variational(X0, delta0)
+    if engine == "jit":
+        Z, fli, status, _ = crtbp_jit.chaos_dop853(Z0, mu, t, R_escape, R_collision,
+                                                   atol, rtol, 1e-3)
+    elif engine == "scipy":
+        Z, fli, status = _variational_scipy(Z0, mu, t, R_escape, R_collision, atol, rtol)
+    else:
+        raise ValueError(f'Not valid engine {engine}')
+
+    t_end = Z[15]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return dict(megno=Z[14]/t_end, lyapunov=Z[12]/t_end, fli=fli,
+                    t_end=t_end, status=int(status))
+
+
+def _run_chunk(indices, mu, X0, t, R_escape, R_collision, delta0, atol, rtol, engine):
+    # mu and X0 hold only the tasks indices
+    results = {field: np.empty(len(indices), dtype=dtype) for field, dtype in FIELDS.items()}
+    for k in range(len(indices)):
+        start = time.perf_counter()
+        result = indicators(X0[k], mu[k], t, R_escape, R_collision, delta0, atol, rtol, engine)
+        for field, value in result.items():
+            results[field][k] = value
+        results['timing'][k] = time.perf_counter() - start
+    return indices, results
+
+
+def chaos_map(mu, X0, t, R_escape=5, R_collision=1e-3, delta0=None, atol=1e-10,
+              rtol=1e-10, processes=None, chunksize=16, engine=None):
+    """Chaos indicators of a grid of orbits over a process pool
+
+    Args:
+        mu (float or array): mass ratio of each task, shape (M,)
+        X0 (array): initial state of each task, shape (M,6) (see make_grid and ae_grid)
+        t (float): Time of integration
+        R_escape, R_collision, delta0, atol, rtol, engine: as in indicators
+        processes (int): number of worker processes, 1 runs in this process
+        chunksize (int): number of tasks sent to a worker at once
+
+    Returns:
+        results (dict): arrays of shape (M,) 'megno', 'lyapunov', 'fli',
+            't_end', 'status' and 'timing' (wall time of every task in seconds)
+    """
+    X0 = np.asarray(X0, dtype=float).reshape((-1, 6))
+    mu = np.broadcast_to(np.asarray(mu, dtype=float), len(X0))
+    engine = engine or ("jit" if crtbp_jit.AVAILABLE else "scipy")
+    if engine == "jit":
+        # Compile once before the workers start
+        indicators(X0[0], mu[0], 1e-3, R_escape, R_collision, delta0, atol, rtol, engine)
+
+    args = (t, R_escape, R_collision, delta0, atol, rtol, engine)
+    chunks = [np.arange(i, min(i+chunksize, len(X0))) for i in range(0, len(X0), chunksize)]
+    results = {field: np.empty(len(X0), dtype=dtype) for field, dtype in FIELDS.items()}
+    if processes == 1:
+        done = (_run_chunk(chunk, mu[chunk], X0[chunk], *args) for chunk in chunks)
+    else:
+        pool = ProcessPoolExecutor(processes)
+        done = pool.map(_run_chunk, chunks, [mu[chunk] for chunk in chunks],
+                        [X0[chunk] for chunk in chunks], *[[arg]*len(chunks) for arg in args])
+    try:
+        for indices, chunk_results in done:
+            for field in FIELDS:
+                results[field][indices] = chunk_results[field]
+    finally:
+        if processes != 1:
+            pool.shutdown()
+    return results
+
+
+def ae_grid(mu, a, e, phase=np.pi):
+    """Planar initial states of orbits around m1 with given semi major axes and eccentricities
+
+    The particle starts at the pericenter of the two body orbit around m1
+    (GM = 1-mu), on a line that makes an angle phase with the direction of
+    m2. Its velocity relative to m1 is added to the inertial velocity of m1
+    about the barycenter, and the state is transformed to the synodic frame.
+
+    Args:
+        mu (float): mass ratio (m2)/(m1+m2)
+        a (array): semi major axes (in units of the separation of the primaries)
+        e (array): eccentricities
+
+    Returns:
+        X0: array of shape (len(a)*len(e),6), ordered as np.meshgrid(a, e, indexing='ij')
+    """
+    A, E = (G.ravel() for G in np.meshgrid(a, e, indexing='ij'))
+    q = A*(1 - E)
+    v = np.sqrt((1 - mu)*(1 + E)/q)
+    X_inertial = np.zeros((6, len(A)))
+    X_inertial[0] = -mu + q*np.cos(phase)
+    X_inertial[1] = q*np.sin(phase)
+    X_inertial[3] = -v*np.sin(phase)
+    # m1 at (-mu, 0) moves with velocity (0, -mu) at t = 0
+    X_inertial[4] = v*np.cos(phase) - mu
+    return Crtbp.Ine2Syn(X_inertial, np.zeros(len(A))).T
+
+
+def xCJ_grid(mu, x, CJ):
+    """Planar initial states on the x axis with given Jacobi constants (sweep.make_grid for one mu)
+
+    Returns:
+        X0: array of shape (M,6), points in the forbidden region are removed
+    """
+    return make_grid(mu, x, CJ)[1]
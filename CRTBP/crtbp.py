@@ -1,11 +1,24 @@
+import os
+import warnings
+
 import numpy as np
 import matplotlib.pyplot as plt
 
-from spiceypy import rotate
 from scipy.integrate import solve_ivp
 
+import potential
+
+
+def _jit():
+    # crtbp_jit (and numba) is only imported once the "jit" engine is requested
+    import crtbp_jit
+    return crtbp_jit
+
 
 class Crtbp():
+    # Routh critical mass ratio, L4 and L5 are linearly stable for mu < ROUTH_MU
+    ROUTH_MU = (1 - np.sqrt(23/27))/2
+
     def __init__(self, X0, mu):
         self.X0 = X0
         self.x0 = X0[0]
@@ -46,16 +59,28 @@ class Crtbp():
 
         return [vx, vy, vz, ax, ay, az]
 
-    def propagate(self, t, dt=200):
+    def propagate(self, t, dt=200, engine="scipy", method="DOP853", h=1e-3):
         """
         Numerical propagation to the  Circular Restriced Three Body Problem  
         Arguments:
             t: Time of Integration 
             dt: intervals between t
+            engine: "scipy" (solve_ivp) or "jit" (compiled loops of crtbp_jit).
+                "jit" falls back to "scipy" when numba is not installed.
+            method: integrator of the "jit" engine: "DOP853" (adaptive),
+                "RK4" or "RK8" (fixed step)
+            h: step size of the fixed step methods
         Returns:
             X: numpy array of shape (6,dt) with test particle's position in each time
             T: array with evaluations time
         """
+        if engine not in ["scipy", "jit"]:
+            raise ValueError(f'Not valid engine {engine}')
+
+        if engine == "jit":
+            if _jit().AVAILABLE:
+                return self.__propagate_jit(t, dt, method, h)
+            warnings.warn('numba is not installed, using the scipy engine')
 
         X_synodic = solve_ivp(self.__Equation_of_motion, y0=self.X0, t_span=[0, t], t_eval=np.linspace(0, t, dt),
                               atol=1e-9, rtol=1e-9, args=(self.mu,))
@@ -64,6 +89,366 @@ class Crtbp():
         T = X_synodic.t
         return X, T
 
+    def __propagate_jit(self, t, dt, method, h):
+        T = np.linspace(0, t, dt)
+        return self.__integrate(self.X0, T, "jit", method, h), T
+
+    def __integrate(self, X0, T, engine, method, h):
+        """ State at the times T starting from X0 at T[0] """
+        X0 = np.asarray(X0, dtype=float)
+        if engine == "scipy":
+            return solve_ivp(self.__Equation_of_motion, y0=X0, t_span=[T[0], T[-1]], t_eval=T,
+                             atol=1e-9, rtol=1e-9, args=(self.mu,)).y
+        if method == "DOP853":
+            X, _ = _jit().propagate_dop853(X0, self.mu, T, 1e-9, 1e-9, h)
+        elif method in ["RK4", "RK8"]:
+            X = _jit().propagate_fixed(X0, self.mu, T, h, int(method[2]))
+        else:
+            raise ValueError(f'Not valid method {method}')
+        return X
+
+    def propagate_stream(self, t, dt=200, chunk=100000, decimate=1, engine="scipy",
+                         method="DOP853", h=1e-3):
+        """
+        Numerical propagation returned in chunks, for trajectories that do not fit in memory
+        Arguments:
+            t: Time of Integration
+            dt: intervals between t (the samples are those of np.linspace(0, t, dt))
+            chunk: maximum number of samples of every chunk
+            decimate: only every decimate-th sample is kept
+            engine, method, h: as in propagate
+        Yields:
+            X: numpy array of shape (6,n) with n <= chunk
+            T: array with evaluations time of the chunk
+        """
+        if engine not in ["scipy", "jit"]:
+            raise ValueError(f'Not valid engine {engine}')
+        if engine == "jit" and not _jit().AVAILABLE:
+            warnings.warn('numba is not installed, using the scipy engine')
+            engine = "scipy"
+
+        # Sample times are generated per chunk, T = step*k (dt = 1 only samples t = 0)
+        step = t/(dt - 1)*decimate if dt > 1 else 0.0
+        n = (dt - 1)//decimate + 1
+        state, t0 = self.X0, 0.0
+        for start in range(0, n, chunk):
+            T = step*np.arange(start, min(start + chunk, n))
+            if start == 0 and len(T) == 1:
+                # A single sample is the initial state
+                X = np.asarray(state, dtype=float).reshape((6, 1))
+            elif start == 0:
+                X = self.__integrate(state, T, engine, method, h)
+            else:
+                # The chunk starts from the last state of the previous one
+                X = self.__integrate(state, np.concatenate([[t0], T]), engine, method, h)[:, 1:]
+            state, t0 = X[:, -1], T[-1]
+            yield X, T
+
+    def propagate_to_disk(self, path, t, dt=200, chunk=100000, decimate=1, **kwargs):
+        """
+        Numerical propagation written chunk by chunk to .npy files
+        Arguments:
+            path: directory where X.npy (6,n) and T.npy (n,) are written
+            t, dt, chunk, decimate: as in propagate_stream
+            kwargs: engine, method and h of propagate
+        Returns:
+            X, T: read only memory maps of the files
+        """
+        os.makedirs(path, exist_ok=True)
+        n = (dt - 1)//decimate + 1
+        X_file = np.lib.format.open_memmap(os.path.join(path, 'X.npy'), mode='w+', shape=(6, n))
+        T_file = np.lib.format.open_memmap(os.path.join(path, 'T.npy'), mode='w+', shape=(n,))
+        start = 0
+        for X, T in self.propagate_stream(t, dt, chunk, decimate, **kwargs):
+            X_file[:, start:start+len(T)] = X
+            T_file[start:start+len(T)] = T
+            start += len(T)
+        X_file.flush()
+        T_file.flush()
+        del X_file, T_file
+        return Crtbp.load_stream(path)
+
+    @staticmethod
+    def load_stream(path, chunk=None):
+        """
+        Trajectory written by propagate_to_disk
+        Arguments:
+            path: directory with X.npy and T.npy
+            chunk: if given, a generator of (X, T) chunks with at most chunk samples
+                (the input of jacobi_drift and stream_Syn2Ine)
+        Returns:
+            X, T: read only memory maps, or the generator of chunks
+        """
+        X = np.load(os.path.join(path, 'X.npy'), mmap_mode='r')
+        T = np.load(os.path.join(path, 'T.npy'), mmap_mode='r')
+        if chunk is None:
+            return X, T
+        return ((np.array(X[:, i:i+chunk]), np.array(T[i:i+chunk]))
+                for i in range(0, len(T), chunk))
+
+    @staticmethod
+    def jacobi_drift(chunks, mu, CJ0=None):
+        """
+        Maximum error of the Jacobi constant in every chunk of a trajectory
+        Arguments:
+            chunks: iterable of (X, T) as given by propagate_stream or load_stream
+            mu: mass ratio (m2)/(m1+m2)
+            CJ0: reference Jacobi constant, by default that of the first sample
+        Returns:
+            drift: numpy array with the maximum |CJ - CJ0| of every chunk
+        """
+        drift = []
+        for X, T in chunks:
+            CJ = Crtbp.get_Jacobi(X, mu)
+            if CJ0 is None:
+                CJ0 = CJ[0]
+            drift.append(np.nanmax(np.abs(CJ - CJ0)))
+        return np.array(drift)
+
+    @staticmethod
+    def stream_Syn2Ine(chunks, mu):
+        """
+        Syn2Ine applied chunk by chunk (the chunks are transformed in place)
+        Arguments:
+            chunks: iterable of (X, T) as given by propagate_stream or load_stream
+            mu: mass ratio (m2)/(m1+m2)
+        Yields:
+            Y_inertial: numpy array with shape (6,n)
+            T: array with evaluations time of the chunk
+        """
+        for X, T in chunks:
+            yield Crtbp.Syn2Ine(X, T, mu, out=X)[2], T
+
+    @staticmethod
+    def get_event(name, mu, radius=None, terminal=False):
+        """ Event function for solve_ivp
+
+        Args:
+            name (str): kind of event
+                'm1', 'm2': distance to m1 (m2) drops below radius
+                'hill': crossing of the Hill sphere of m2 (Crtbp.get_RHill)
+                'escape': distance to the barycenter grows beyond radius
+                'x_axis': crossing of the x axis (y = 0)
+            mu (float): mass ratio (m2)/(m1+m2)
+            radius (float): radius of the 'm1', 'm2' and 'escape' events
+            terminal (bool): if True the integration stops at the event
+
+        Returns:
+            event (function): event(t, X, mu) with the attributes required by solve_ivp
+        """
+        if name == 'm1':
+            def event(t, X, mu): return np.sqrt((X[0]+mu)**2+X[1]**2+X[2]**2) - radius
+            event.direction = -1
+        elif name == 'm2':
+            def event(t, X, mu): return np.sqrt((X[0]-1+mu)**2+X[1]**2+X[2]**2) - radius
+            event.direction = -1
+        elif name == 'hill':
+            R_hill = Crtbp.get_RHill(mu)
+            def event(t, X, mu): return np.sqrt((X[0]-1+mu)**2+X[1]**2+X[2]**2) - R_hill
+            event.direction = 0
+        elif name == 'escape':
+            def event(t, X, mu): return np.sqrt(X[0]**2+X[1]**2+X[2]**2) - radius
+            event.direction = 1
+        elif name == 'x_axis':
+            def event(t, X, mu): return X[1]
+            event.direction = 0
+        else:
+            raise ValueError(f'Not valid event {name}')
+
+        event.terminal = terminal
+        event.__name__ = name
+        return event
+
+    def propagate_events(self, t, dt=200, R_collision=None, R_escape=None, hill=False,
+                         x_axis=False, terminal=('m1', 'm2', 'escape')):
+        """
+        Numerical propagation with detection of events (see Crtbp.get_event)
+        Arguments:
+            t: Time of Integration
+            dt: intervals between t
+            R_collision: collision radius around m1 and m2, a float or a pair (R1,R2)
+            R_escape: escape radius around the barycenter
+            hill: if True record the crossings of the Hill sphere of m2
+            x_axis: if True record the crossings of the x axis
+            terminal: names of the events that stop the integration
+        Returns:
+            X: numpy array of shape (6,n) with test particle's position in each
+                time (n <= dt when the integration stops early)
+            T: array with evaluations time
+            events: dictionary name -> (t_events, X_events) with X_events of shape (6,n_events)
+            stop: name of the event that stopped the integration (None if it reached t)
+        """
+        radii = {}
+        if R_collision is not None:
+            radii['m1'], radii['m2'] = np.broadcast_to(R_collision, 2)
+        if R_escape is not None:
+            radii['escape'] = R_escape
+        if hill:
+            radii['hill'] = None
+        if x_axis:
+            radii['x_axis'] = None
+
+        events = [Crtbp.get_event(name, self.mu, radius, name in terminal)
+                  for name, radius in radii.items()]
+
+        X_synodic = solve_ivp(self.__Equation_of_motion, y0=self.X0, t_span=[0, t], t_eval=np.linspace(0, t, dt),
+                              atol=1e-9, rtol=1e-9, args=(self.mu,), events=events or None)
+
+        found = {}
+        stop = None
+        for event, t_events, X_events in zip(events, X_synodic.t_events, X_synodic.y_events):
+            found[event.__name__] = (t_events, X_events.reshape((-1, 6)).T)
+            if X_synodic.status == 1 and event.terminal and len(t_events):
+                stop = event.__name__
+        return X_synodic.y, X_synodic.t, found, stop
+
+    @staticmethod
+    def __Equation_of_motion_ensemble(t, X, mu):
+        """ Vectorized equations of motion in the CRTBP
+
+        Args:
+            t (float): Time of integration (only used to propagation)
+            X (array): States of N particles, shape (6,N)
+            mu (float): mass ratio (m2)/(m1+m2)
+
+        Returns:
+            dX/dt (array): Time derivative of the states, shape (6,N)
+        """
+        x, y, z, vx, vy, vz = X
+        mu1 = 1-mu
+        mu2 = mu
+        r1 = np.sqrt((x+mu2)**2 + y**2+z**2)
+        r2 = np.sqrt((x-mu1)**2 + y**2+z**2)
+
+        mu_r1 = mu1/(r1**3)
+        mu_r2 = mu2/(r2**3)
+
+        dX = np.empty_like(X)
+        dX[:3] = X[3:]
+        dX[3] = 2*vy+x-(x+mu2)*mu_r1-(x-mu1)*mu_r2
+        dX[4] = -2*vx+y - (mu_r1+mu_r2)*y
+        dX[5] = -(mu_r1+mu_r2)*z
+        return dX
+
+    # Dormand-Prince 5(4) tableau used by the per particle integrator
+    __DP_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+    __DP_A = [[],
+              [1/5],
+              [3/40, 9/40],
+              [44/45, -56/15, 32/9],
+              [19372/6561, -25360/2187, 64448/6561, -212/729],
+              [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+              [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]]
+    __DP_E = np.array([71/57600, 0, -71/16695, 71/1920,
+                       -17253/339200, 22/525, -1/40])
+
+    @staticmethod
+    def __rk45_ensemble(X0s, mu, T, atol, rtol):
+        """ Dormand-Prince integration with an independent step size per particle
+
+        Every stage evaluates the right hand side once for all the particles
+        still running. Steps are clipped to land exactly on the times in T.
+
+        Args:
+            X0s (array): Initial states, shape (6,N)
+            mu (float): mass ratio (m2)/(m1+m2)
+            T (array): Evaluation times, T[0] = 0
+            atol, rtol (float): Absolute and relative tolerances
+
+        Returns:
+            X: numpy array of shape (N,6,len(T))
+        """
+        n = X0s.shape[1]
+        X = np.empty((n, 6, len(T)))
+        X[:, :, 0] = X0s.T
+
+        Y = X0s.copy()
+        t = np.zeros(n)
+        k = np.ones(n, dtype=int)
+        h = np.full(n, min(1e-2, T[-1]/len(T)) if len(T) > 1 else 0.0)
+
+        A = Crtbp.__DP_A
+        C = Crtbp.__DP_C
+        E = Crtbp.__DP_E
+        active = np.nonzero(k < len(T))[0]
+        while active.size:
+            y = Y[:, active]
+            t_next = T[k[active]]
+            step = np.minimum(h[active], t_next - t[active])
+
+            K = [Crtbp.__Equation_of_motion_ensemble(0, y, mu)]
+            for i in range(1, 7):
+                dy = sum(a*Ki for a, Ki in zip(A[i], K) if a != 0)
+                K.append(Crtbp.__Equation_of_motion_ensemble(
+                    C[i], y + step*dy, mu))
+            y_new = y + step*sum(a*Ki for a, Ki in zip(A[6], K) if a != 0)
+            error = step*sum(e*Ki for e, Ki in zip(E, K) if e != 0)
+
+            scale = atol + rtol*np.maximum(np.abs(y), np.abs(y_new))
+            norm = np.sqrt(np.mean((error/scale)**2, axis=0))
+            accept = norm <= 1
+
+            with np.errstate(divide='ignore'):
+                factor = np.clip(0.9*norm**(-1/5), 0.2, 10)
+            h_new = step*factor
+            clipped = step < h[active]
+            h[active] = np.where(clipped & accept,
+                                 np.maximum(h_new, h[active]), h_new)
+
+            done = active[accept]
+            Y[:, done] = y_new[:, accept]
+            t[done] += step[accept]
+
+            hit = done[clipped[accept] | (t[done] >= T[k[done]])]
+            t[hit] = T[k[hit]]
+            X[hit, :, k[hit]] = Y[:, hit].T
+            k[hit] += 1
+
+            # Particles whose step collapses (e.g. collisions) are stopped
+            stalled = active[~(h[active] > 10*np.spacing(t[active]))]
+            for i in stalled:
+                X[i, :, k[i]:] = np.nan
+                k[i] = len(T)
+
+            active = active[k[active] < len(T)]
+        return X
+
+    @staticmethod
+    def propagate_ensemble(X0s, mu, t, n_eval=200, shared_step=False,
+                           atol=1e-9, rtol=1e-9):
+        """
+        Numerical propagation of an ensemble of test particles in the CRTBP.
+        All the particles are integrated together with a vectorized right hand side.
+        Arguments:
+            X0s: array of shape (N,6) with the initial states [x,y,z,vx,vy,vz]
+            mu: mass ratio (m2)/(m1+m2)
+            t: Time of Integration
+            n_eval: number of evaluation times between 0 and t
+            shared_step: if True a single step size is shared by all the particles
+                (one solve_ivp call on the stacked state). If False each particle
+                has its own adaptive step size.
+            atol, rtol: Absolute and relative tolerances
+        Returns:
+            X: numpy array of shape (N,6,n_eval) with the particles' states in each time
+            T: array with evaluations time
+        """
+        X0s = np.atleast_2d(np.asarray(X0s, dtype=float))
+        n = X0s.shape[0]
+        T = np.linspace(0, t, n_eval)
+
+        if shared_step:
+            def equation(t, Y, mu):
+                return Crtbp.__Equation_of_motion_ensemble(
+                    t, Y.reshape((6, n)), mu).ravel()
+
+            solution = solve_ivp(equation, y0=X0s.T.ravel(), t_span=[0, t], t_eval=T,
+                                 atol=atol, rtol=rtol, args=(mu,))
+            X = solution.y.reshape((6, n, n_eval)).transpose(1, 0, 2)
+            return X, T
+
+        X = Crtbp.__rk45_ensemble(X0s.T.copy(), mu, T, atol, rtol)
+        return X, T
+
     def plot_trayectory(self, t, dt=200, inertial=False, Lagrange=False, zero_curve=False, **args):
 
         Lagrange = self.Lagrange(self.mu)
@@ -99,20 +484,12 @@ class Crtbp():
                 raise UserWarning(
                     'Cannot generate Zero velocity curve in three dimension plots')
             else:
-                x = np.linspace(-1.5, 1.5, 100)
-                y = np.linspace(-1.5, 1.5, 100)
-                X_mesh, Y_mesh = np.meshgrid(x, y)
-
-                mu1 = 1-self.mu
-                mu2 = self.mu
-
-                r1 = np.sqrt((X_mesh+mu2)**2+Y_mesh**2)
-                r2 = np.sqrt((X_mesh-mu1)**2+Y_mesh**2)
-                CJ = X_mesh**2+Y_mesh**2+2*(mu1/r1+mu2/r2)
+                # The grid is computed once per mu (potential.cache)
+                grid = potential.get_grid(self.mu)
 
                 ax = axs if not inertial else axs[0]
 
-                ax.contourf(X_mesh, Y_mesh, CJ,
+                ax.contourf(grid.x, grid.y, grid.CJ,
                             levels=[-100, self.jacobi], colors='k', alpha=0.3)
 
         if inertial:
@@ -172,6 +549,28 @@ class Crtbp():
 
         return CJ
 
+    @staticmethod
+    def get_Jacobi_velocity(X, CJ, mu):
+        """ Speed of a test particle at a given position and Jacobi constant
+
+        Args:
+            X (list): Position vector [x,y,z] (each component may be an array)
+            CJ (float): Jacobi constant
+            mu (float): mass ratio (m2/(m1+m2))
+
+        Returns:
+            v (float): Speed in the rotating frame, NaN inside the forbidden region
+        """
+        x, y, z = X[:3]
+        mu1 = 1-mu
+        mu2 = mu
+
+        r1 = np.sqrt((x+mu2)**2+y**2 + z**2)
+        r2 = np.sqrt((x-mu1)**2+y**2 + z**2)
+
+        v2 = x**2+y**2+2*(mu1/r1+mu2/r2) - CJ
+        return np.sqrt(np.where(v2 >= 0, v2, np.nan))
+
     @staticmethod
     def Lagrange(mu, point=0):
         """ Locations of System's Lagrange Points 
@@ -216,10 +615,60 @@ class Crtbp():
         return tisserand
 
     @staticmethod
-    def __potential_derivatives(mu, L):
+    def Lagrange_array(mu, tol=1e-15, maxiter=30, derivatives=False):
+        """ Exact locations of the Lagrange Points for an array of mass ratios
 
-        x0, y0 = Crtbp.Lagrange(mu, point=L) if type(Crtbp.Lagrange(mu, point=L)
-                                                     ) == list else [Crtbp.Lagrange(mu, point=L), 0]
+        The collinear points are the roots of Ux(x,0) = 0, found with Newton
+        iterations seeded with the series of Crtbp.Lagrange (Ux is monotonic
+        between the primaries, so every root is bracketed by them).
+
+        Args:
+            mu (array): mass ratios m2/(m1+m2), shape (N,)
+            tol (float): tolerance on the position of the collinear points
+            maxiter (int): maximum number of Newton iterations
+            derivatives (bool): If True, also return the second derivatives of the
+                potential and the eigenvalues of the linearized motion at every point
+
+        Returns:
+            L: numpy array of shape (N,5,2) with [x,y] of L1...L5
+            Uxx, Uyy, Uxy: numpy arrays of shape (N,5) (only if derivatives)
+            eigens: complex array of shape (N,5,4) (only if derivatives)
+        """
+        mu = np.atleast_1d(np.asarray(mu, dtype=float))
+        mu1 = 1 - mu
+        mu2 = mu
+        L1, L2, L3 = (np.broadcast_to(L, mu.shape) for L in Crtbp.Lagrange(mu)[:3])
+
+        # Intervals of the collinear points: L3 < -mu2 < L1 < mu1 < L2
+        eps = 1e-12
+        lower = np.stack([-mu2 + eps, mu1 + eps, np.full(mu.shape, -2.0)])
+        upper = np.stack([mu1 - eps, np.full(mu.shape, 2.0), -mu2 - eps])
+        x = np.clip(np.stack([L1, L2, L3]), lower, upper)
+        for _ in range(maxiter):
+            d1 = x + mu2
+            d2 = x - mu1
+            f = x - mu1*d1/np.abs(d1)**3 - mu2*d2/np.abs(d2)**3
+            df = 1 + 2*mu1/np.abs(d1)**3 + 2*mu2/np.abs(d2)**3
+            step = f/df
+            x = np.clip(x - step, lower, upper)
+            if np.all(np.abs(step) < tol):
+                break
+
+        L = np.zeros(mu.shape + (5, 2))
+        L[:, :3, 0] = x.T
+        L[:, 3:, 0] = (1/2 - mu2)[:, None]
+        L[:, 3, 1] = np.sqrt(3)/2
+        L[:, 4, 1] = -np.sqrt(3)/2
+        if not derivatives:
+            return L
+
+        Uxx, Uyy, Uxy = Crtbp.__potential_hessian(mu[:, None], L[..., 0], L[..., 1])
+        eigens = np.moveaxis(Crtbp.__eigenvalues_Lagrange(Uxx, Uyy, Uxy), 0, -1)
+        return L, Uxx, Uyy, Uxy, eigens
+
+    @staticmethod
+    def __potential_hessian(mu, x0, y0):
+        """ Second derivatives Uxx, Uyy, Uxy of the potential at (x0,y0), broadcast over arrays """
         mu1 = 1 - mu
         mu2 = mu
         r10 = np.sqrt((x0+mu2)**2 + y0**2)
@@ -234,6 +683,12 @@ class Crtbp():
         Uxy = C
         return Uxx, Uyy, Uxy
 
+    @staticmethod
+    def __potential_derivatives(mu, L):
+        # Exact point (Lagrange_array), not the series of Crtbp.Lagrange
+        x0, y0 = Crtbp.Lagrange_array(mu)[0, L-1]
+        return Crtbp.__potential_hessian(mu, x0, y0)
+
     @staticmethod
     def __eigenvalues_Lagrange(Uxx, Uyy, Uxy):
 
@@ -260,6 +715,98 @@ class Crtbp():
         beta = alpha*betas
         return alpha, beta, eigens
 
+    @staticmethod
+    def __linear_coefficients_batch(X0, V0, Uxx, Uxy, eigens):
+        """ Coefficients alpha, beta (...,4) of the linear motion for batches of
+        perturbations X0, V0 (...,2) and eigenvalues (...,4). Degenerate
+        eigenvalues (singular systems) give NaN """
+        betas = (eigens**2-Uxx[..., None])/(2*eigens+Uxy[..., None])
+        coefficients = np.stack([np.ones_like(eigens), eigens, betas, betas*eigens], axis=-2)
+        IC = np.concatenate([X0, V0], axis=-1).astype(complex)
+        coefficients, IC = np.broadcast_arrays(coefficients, IC[..., None])
+
+        condition = np.linalg.cond(coefficients)
+        singular = ~(condition < 1e14)
+        coefficients = np.where(singular[..., None, None], np.eye(4), coefficients)
+        alpha = np.linalg.solve(coefficients, IC)[..., 0]
+        alpha = np.where(singular[..., None], np.nan, alpha)
+        return alpha, alpha*betas
+
+    @staticmethod
+    def __linear_motion(alpha, beta, eigens, t):
+        # x and y (...,2,Nt) from one exponential of the outer product eigens x t
+        E = np.exp(eigens[..., :, None]*t)
+        x = np.einsum('...k,...kt->...t', alpha, E)
+        y = np.einsum('...k,...kt->...t', beta, E)
+        return np.stack([x, y], axis=-2).real
+
+    @staticmethod
+    def stability_batch(X0, V0, mu, L, t, eigenvalues=False):
+        """ Linear motion around a Lagrange point for a batch of perturbations (Crtbp.stability
+            evaluated on arrays)
+
+        Args:
+            X0 (array): positions of the perturbations respect to the Lagrange point, shape (N,2)
+            V0 (array): velocities of the perturbations, shape (N,2)
+            mu (float): mass ratio (m2)/(m1+m2)
+            L (int): Lagrange Point
+            t (array): times, shape (Nt,)
+            eigenvalues (bool, optional): If True, also return the eigenvalues. Defaults to False.
+
+        Returns:
+            XY (array): x and y of every perturbation, shape (N,2,Nt)
+            eigens (array): eigenvalues of the linearized motion, shape (4,)
+        """
+        X0 = np.atleast_2d(np.asarray(X0, dtype=float))
+        V0 = np.atleast_2d(np.asarray(V0, dtype=float))
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        Uxx, Uyy, Uxy = Crtbp.__potential_derivatives(mu, L)
+        eigens = Crtbp.__eigenvalues_Lagrange(Uxx, Uyy, Uxy)
+
+        alpha, beta = Crtbp.__linear_coefficients_batch(X0, V0, np.asarray(Uxx), np.asarray(Uxy), eigens)
+        XY = Crtbp.__linear_motion(alpha, beta, eigens, t)
+        if eigenvalues:
+            return XY, eigens
+        return XY
+
+    @staticmethod
+    def stability_map(mu=None, L=4, t=None, X0=(1e-5, 1e-5), V0=(0, 0), tol=1e-10):
+        """ Linear stability of a Lagrange point for an array of mass ratios
+
+        Args:
+            mu (array): mass ratios, by default 201 values in [0, 2 ROUTH_MU]
+                (across the Routh critical value of L4 and L5)
+            L (int): Lagrange Point
+            t (array): if given, the linear motion of the perturbation X0, V0 is
+                also evaluated at these times for every mu
+            X0, V0 (list): position and velocity of the perturbation
+            tol (float): largest real part of the eigenvalues of a stable point
+
+        Returns:
+            mu (array): mass ratios, shape (M,)
+            growth (array): largest real part of the eigenvalues, shape (M,)
+            stable (array): True where the point is linearly stable, shape (M,)
+            eigens (array): eigenvalues, shape (M,4)
+            XY (array): linear motion, shape (M,2,Nt) (only if t is given).
+                NaN where the eigenvalues are degenerate (singular system).
+        """
+        if mu is None:
+            mu = np.linspace(0, 2*Crtbp.ROUTH_MU, 201)[1:]
+        mu = np.atleast_1d(np.asarray(mu, dtype=float))
+        _, Uxx, Uyy, Uxy, eigens = Crtbp.Lagrange_array(mu, derivatives=True)
+        Uxx, Uyy, Uxy, eigens = Uxx[:, L-1], Uyy[:, L-1], Uxy[:, L-1], eigens[:, L-1]
+
+        growth = eigens.real.max(axis=-1)
+        stable = growth <= tol
+        if t is None:
+            return mu, growth, stable, eigens
+
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        X0 = np.broadcast_to(np.asarray(X0, dtype=float), mu.shape + (2,))
+        V0 = np.broadcast_to(np.asarray(V0, dtype=float), mu.shape + (2,))
+        alpha, beta = Crtbp.__linear_coefficients_batch(X0, V0, Uxx, Uxy, eigens)
+        return mu, growth, stable, eigens, Crtbp.__linear_motion(alpha, beta, eigens, t)
+
     @staticmethod
     def stability(X0, V0, mu, L, eigenvalues=False):
         """ Analysis of Lagrange point stablility respect to an initial planar perturbation 
@@ -276,6 +823,13 @@ class Crtbp():
 
         Returns:
             x,y (function): Propagation functions of perturbation in x and y direction
+
+        Note:
+            The motion is linearized about the exact Lagrange point of
+            Crtbp.Lagrange_array. Earlier versions used the series of
+            Crtbp.Lagrange, whose L1-L3 are off by up to ~2e-2 at mu = 0.3
+            (~5e-5 at mu = 0.01), so the eigenvalues and the propagated
+            perturbation of L1-L3 differ from those results for large mu.
         """
 
         alpha, beta, eigens = Crtbp.__Linear_Coefficients(X0, V0, mu, L)
@@ -289,67 +843,89 @@ class Crtbp():
         return np.vectorize(x), np.vectorize(y)
 
     @staticmethod
-    def Syn2Ine(X_synodic, t_span, mu):
+    def __rotate_z(X, cos, sin, sign, out):
+        """ Rotation of a batch of states about the z axis of the rotating frame
+
+        Args:
+            X (array): States, shape (...,6,N)
+            cos, sin (array): cos(t) and sin(t), shape (N,)
+            sign (int): +1 for synodic to inertial, -1 for inertial to synodic
+            out (array): Output buffer with the same shape of X
+
+        Returns:
+            out (array): Rotated states, shape (...,6,N)
+        """
+        x, y, z, vx, vy, vz = (X[..., i, :] for i in range(6))
+        # Velocities relative to the frame of arrival: v + sign * (z x r)
+        wx = vx - sign*y
+        wy = vy + sign*x
+        ssin = sign*sin
+        # x and y must be fully used before out[..., 0:2, :] is written
+        # because out may be X itself
+        xr = cos*x - ssin*y
+        out[..., 1, :] = ssin*x + cos*y
+        out[..., 0, :] = xr
+        out[..., 2, :] = z
+        out[..., 3, :] = cos*wx - ssin*wy
+        out[..., 4, :] = ssin*wx + cos*wy
+        out[..., 5, :] = vz
+        return out
+
+    @staticmethod
+    def __as_trajectory(X):
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X.reshape((6, 1))
+        return X
+
+    @staticmethod
+    def Syn2Ine(X_synodic, t_span, mu, out=None):
         """
         Transformation between rotational (synodic) frame to inertial frame
         Arguments:
-            X_synodic: Positional vector in rotational frame [x,y,z,vx,vy,vz]
+            X_synodic: Positional vector in rotational frame [x,y,z,vx,vy,vz],
+                shape (6,dt) or a batch of trajectories with shape (...,6,dt)
             t_span: Time array
+            out: optional array with the shape of X_synodic where Y_inertial is stored
         Returns:
-            r1: numpy array with shape (dt,3). Position x,y,z of main body with mass m1
-            r2: numpy array with shape (dt,3). Position x,y,z of secondary body with mass m3
-            Y_inertial: numpy array with shape (dt,6). Position x,y,z,vx,vy,vz to test Particle
+            r1: numpy array with shape (3,dt). Position x,y,z of main body with mass m1
+            r2: numpy array with shape (3,dt). Position x,y,z of secondary body with mass m3
+            Y_inertial: numpy array with shape (...,6,dt). Position x,y,z,vx,vy,vz to test Particle
 
         """
-        try:
-            X_synodic.shape[1]
-        except:
-            X_synodic = np.array(X_synodic).reshape((6, 1))
+        X_synodic = Crtbp.__as_trajectory(X_synodic)
+        t_span = np.asarray(t_span, dtype=float)
+        cos, sin = np.cos(t_span), np.sin(t_span)
 
-        Y_inertial = np.zeros(X_synodic.shape)
+        if out is None:
+            out = np.empty(X_synodic.shape)
+        Y_inertial = Crtbp.__rotate_z(X_synodic, cos, sin, 1, out)
 
         # Vectors of main and secondary body
-        r1 = np.zeros_like((X_synodic[:3, :]))
-        r2 = np.zeros_like((X_synodic[:3, :]))
-        for i in range(len(t_span)):
-            R = rotate(-t_span[i], 3)
-            r_i = np.matrix(X_synodic[:3, i])
-            v_i = np.matrix(X_synodic[3:, i])
-            Y_inertial[:3, i] = (R*r_i.T).T
-            Y_inertial[3:, i] = (R*(v_i + np.cross([0, 0, 1], r_i)).T).T
-            r1[:, i] = -mu * \
-                np.array([np.cos(t_span[i]), np.sin(t_span[i]), 0])
-            r2[:, i] = (1-mu) * \
-                np.array([np.cos(t_span[i]), np.sin(t_span[i]), 0])
+        unit = np.array([cos, sin, np.zeros_like(cos)])
+        r1 = -mu*unit
+        r2 = (1-mu)*unit
         return r1, r2, Y_inertial
 
     @staticmethod
-    def Ine2Syn(X_inertial, t_span):
+    def Ine2Syn(X_inertial, t_span, out=None):
         """
         Transformation between inertial frame to rotational (synodic) frame t
         Arguments:
-            X_inertial: Positional vector in inertial frame [x,y,z,vx,vy,vz]
+            X_inertial: Positional vector in inertial frame [x,y,z,vx,vy,vz],
+                shape (6,dt) or a batch of trajectories with shape (...,6,dt)
             t_span: Time array
+            out: optional array with the shape of X_inertial where X_synodic is stored
         Returns:
-            r1: numpy array with shape (dt,3). Position x,y,z of main body with mass m1
-            r2: numpy array with shape (dt,3). Position x,y,z of secondary body with mass m3
-            Y_inertial: numpy array with shape (dt,6). Position x,y,z,vx,vy,vz to test Particle
+            X_synodic: numpy array with shape (...,6,dt). Position x,y,z,vx,vy,vz to test Particle
 
         """
+        X_inertial = Crtbp.__as_trajectory(X_inertial)
+        t_span = np.asarray(t_span, dtype=float)
 
-        if not isinstance(X_inertial, np.ndarray):
-            X_inertial = np.array(X_inertial).reshape((6, 1))
-
-        X_synodic = np.zeros(X_inertial.shape)
-
-        for i in range(X_inertial.shape[1]):
-            R = rotate(t_span[i], 3)
-            r_i = np.matrix(X_inertial[:3, i])
-            v_i = np.matrix(X_inertial[3:, i])
-            X_synodic[:3, i] = (R*r_i.T).T
-            X_synodic[3:, i] = (R*(v_i - np.cross([0, 0, 1], r_i)).T).T
-
-        return X_synodic
+        if out is None:
+            out = np.empty(X_inertial.shape)
+        return Crtbp.__rotate_z(X_inertial, np.cos(t_span), np.sin(t_span), -1, out)
 
     @staticmethod
     def get_RHill(mu):
@@ -0,0 +1,580 @@
+"""
+Compiled integration engine for the Circular Restricted Three Body Problem.
+
+The right hand side and the integration loops are compiled with numba when
+it is installed (AVAILABLE = True). Without numba the same functions run as
+plain Python, and Crtbp.propagate(engine="jit") falls back to solve_ivp.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+# Dormand-Prince 8(5,3) tableau (Hairer, Norsett & Wanner; the coefficients of
+# scipy's DOP853), the 12 stages of a step
+N_STAGES = 12
+
+C = np.array([0.0,
+              0.526001519587677318785587544488e-01,
+              0.789002279381515978178381316732e-01,
+              0.118350341907227396726757197510,
+              0.281649658092772603273242802490,
+              0.333333333333333333333333333333,
+              0.25,
+              0.307692307692307692307692307692,
+              0.651282051282051282051282051282,
+              0.6,
+              0.857142857142857142857142857142,
+              1.0])
+
+A = np.zeros((N_STAGES, N_STAGES))
+A[1, 0] = 5.26001519587677318785587544488e-2
+
+A[2, 0] = 1.97250569845378994544595329183e-2
+A[2, 1] = 5.91751709536136983633785987549e-2
+
+A[3, 0] = 2.95875854768068491816892993775e-2
+A[3, 2] = 8.87627564304205475450678981324e-2
+
+A[4, 0] = 2.41365134159266685502369798665e-1
+A[4, 2] = -8.84549479328286085344864962717e-1
+A[4, 3] = 9.24834003261792003115737966543e-1
+
+A[5, 0] = 3.7037037037037037037037037037e-2
+A[5, 3] = 1.70828608729473871279604482173e-1
+A[5, 4] = 1.25467687566822425016691814123e-1
+
+A[6, 0] = 3.7109375e-2
+A[6, 3] = 1.70252211019544039314978060272e-1
+A[6, 4] = 6.02165389804559606850219397283e-2
+A[6, 5] = -1.7578125e-2
+
+A[7, 0] = 3.70920001185047927108779319836e-2
+A[7, 3] = 1.70383925712239993810214054705e-1
+A[7, 4] = 1.07262030446373284651809199168e-1
+A[7, 5] = -1.53194377486244017527936158236e-2
+A[7, 6] = 8.27378916381402288758473766002e-3
+
+A[8, 0] = 6.24110958716075717114429577812e-1
+A[8, 3] = -3.36089262944694129406857109825
+A[8, 4] = -8.68219346841726006818189891453e-1
+A[8, 5] = 2.75920996994467083049415600797e1
+A[8, 6] = 2.01540675504778934086186788979e1
+A[8, 7] = -4.34898841810699588477366255144e1
+
+A[9, 0] = 4.77662536438264365890433908527e-1
+A[9, 3] = -2.48811461997166764192642586468
+A[9, 4] = -5.90290826836842996371446475743e-1
+A[9, 5] = 2.12300514481811942347288949897e1
+A[9, 6] = 1.52792336328824235832596922938e1
+A[9, 7] = -3.32882109689848629194453265587e1
+A[9, 8] = -2.03312017085086261358222928593e-2
+
+A[10, 0] = -9.3714243008598732571704021658e-1
+A[10, 3] = 5.18637242884406370830023853209
+A[10, 4] = 1.09143734899672957818500254654
+A[10, 5] = -8.14978701074692612513997267357
+A[10, 6] = -1.85200656599969598641566180701e1
+A[10, 7] = 2.27394870993505042818970056734e1
+A[10, 8] = 2.49360555267965238987089396762
+A[10, 9] = -3.0467644718982195003823669022
+
+A[11, 0] = 2.27331014751653820792359768449
+A[11, 3] = -1.05344954667372501984066689879e1
+A[11, 4] = -2.00087205822486249909675718444
+A[11, 5] = -1.79589318631187989172765950534e1
+A[11, 6] = 2.79488845294199600508499808837e1
+A[11, 7] = -2.85899827713502369474065508674
+A[11, 8] = -8.87285693353062954433549289258
+A[11, 9] = 1.23605671757943030647266201528e1
+A[11, 10] = 6.43392746015763530355970484046e-1
+
+B = np.zeros(N_STAGES)
+B[0] = 5.42937341165687622380535766363e-2
+B[5] = 4.45031289275240888144113950566
+B[6] = 1.89151789931450038304281599044
+B[7] = -5.8012039600105847814672114227
+B[8] = 3.1116436695781989440891606237e-1
+B[9] = -1.52160949662516078556178806805e-1
+B[10] = 2.01365400804030348374776537501e-1
+B[11] = 4.47106157277725905176885569043e-2
+
+E3 = np.zeros(N_STAGES + 1)
+E3[:-1] = B.copy()
+E3[0] -= 0.244094488188976377952755905512
+E3[8] -= 0.733846688281611857341361741547
+E3[11] -= 0.220588235294117647058823529412e-1
+
+E5 = np.zeros(N_STAGES + 1)
+E5[0] = 0.1312004499419488073250102996e-1
+E5[5] = -0.1225156446376204440720569753e+1
+E5[6] = -0.4957589496572501915214079952
+E5[7] = 0.1664377182454986536961530415e+1
+E5[8] = -0.3503288487499736816886487290
+E5[9] = 0.3341791187130174790297318841
+E5[10] = 0.8192320648511571246570742613e-1
+E5[11] = -0.2235530786388629525884427845e-1
+
+EPS = np.finfo(np.float64).eps
+SAFETY = 0.9
+MIN_FACTOR = 0.2
+MAX_FACTOR = 10.0
+
+
+@njit(cache=True)
+def equation_of_motion(X, mu, dX):
+    """ Equations of motion in the CRTBP, written into dX
+
+    Args:
+        X (array): State vector of the system [x,y,z,vx,vy,vz]
+        mu (float): mass ratio (m2)/(m1+m2)
+        dX (array): Output array for the time derivative of X
+    """
+    x, y, z, vx, vy, vz = X[0], X[1], X[2], X[3], X[4], X[5]
+    mu1 = 1-mu
+    mu2 = mu
+    r1 = np.sqrt((x+mu2)**2 + y**2+z**2)
+    r2 = np.sqrt((x-mu1)**2 + y**2+z**2)
+
+    mu_r1 = mu1/(r1**3)
+    mu_r2 = mu2/(r2**3)
+
+    dX[0] = vx
+    dX[1] = vy
+    dX[2] = vz
+    dX[3] = 2*vy+x-(x+mu2)*mu_r1-(x-mu1)*mu_r2
+    dX[4] = -2*vx+y - (mu_r1+mu_r2)*y
+    dX[5] = -(mu_r1+mu_r2)*z
+
+
+@njit(cache=True)
+def rk4_step(X, mu, h, K, Y, X_new):
+    """ Classic fourth order Runge-Kutta step from X to X_new """
+    equation_of_motion(X, mu, K[0])
+    for i in range(6):
+        Y[i] = X[i] + 0.5*h*K[0, i]
+    equation_of_motion(Y, mu, K[1])
+    for i in range(6):
+        Y[i] = X[i] + 0.5*h*K[1, i]
+    equation_of_motion(Y, mu, K[2])
+    for i in range(6):
+        Y[i] = X[i] + h*K[2, i]
+    equation_of_motion(Y, mu, K[3])
+    for i in range(6):
+        X_new[i] = X[i] + h*(K[0, i] + 2*K[1, i] + 2*K[2, i] + K[3, i])/6
+
+
+@njit(cache=True)
+def rk8_step(X, mu, h, K, Y, X_new):
+    """ Eighth order Runge-Kutta step (DOP853 weights, no error control) """
+    equation_of_motion(X, mu, K[0])
+    for s in range(1, N_STAGES):
+        for i in range(6):
+            dy = 0.0
+            for j in range(s):
+                dy += A[s, j]*K[j, i]
+            Y[i] = X[i] + h*dy
+        equation_of_motion(Y, mu, K[s])
+    for i in range(6):
+        dy = 0.0
+        for j in range(N_STAGES):
+            dy += B[j]*K[j, i]
+        X_new[i] = X[i] + h*dy
+
+
+@njit(cache=True)
+def propagate_fixed(X0, mu, T, h, order):
+    """ Fixed step propagation evaluated at the times T
+
+    Every interval of T is covered with the smallest number of equal
+    steps not larger than h.
+
+    Args:
+        X0 (array): Initial state [x,y,z,vx,vy,vz]
+        mu (float): mass ratio (m2)/(m1+m2)
+        T (array): Evaluation times, T[0] is the initial time
+        h (float): Maximum step size
+        order (int): 4 (RK4) or 8 (RK8)
+
+    Returns:
+        X: numpy array of shape (6,len(T))
+    """
+    X = np.empty((6, len(T)))
+    K = np.empty((N_STAGES, 6))
+    Y = np.empty(6)
+    state = X0.copy()
+    new = np.empty(6)
+    X[:, 0] = state
+    for k in range(1, len(T)):
+        interval = T[k] - T[k-1]
+        n = max(1, int(np.ceil(abs(interval)/h)))
+        step = interval/n
+        for _ in range(n):
+            if order == 4:
+                rk4_step(state, mu, step, K, Y, new)
+            else:
+                rk8_step(state, mu, step, K, Y, new)
+            state[:] = new
+        X[:, k] = state
+    return X
+
+
+@njit(cache=True)
+def dop853_step(X, mu, h, f, K, Y, X_new):
+    """ DOP853 step from X to X_new
+
+    Args:
+        f (array): Derivative at X (first stage)
+        K (array): Stage storage, shape (N_STAGES+1,6). K[-1] holds the
+            derivative at X_new on exit.
+    """
+    K[0] = f
+    for s in range(1, N_STAGES):
+        for i in range(6):
+            dy = 0.0
+            for j in range(s):
+                dy += A[s, j]*K[j, i]
+            Y[i] = X[i] + h*dy
+        equation_of_motion(Y, mu, K[s])
+    for i in range(6):
+        dy = 0.0
+        for j in range(N_STAGES):
+            dy += B[j]*K[j, i]
+        X_new[i] = X[i] + h*dy
+    equation_of_motion(X_new, mu, K[N_STAGES])
+
+
+@njit(cache=True)
+def dop853_error_norm(X, X_new, K, h, atol, rtol):
+    n = X.shape[0]
+    err5 = 0.0
+    err3 = 0.0
+    for i in range(n):
+        scale = atol + rtol*max(abs(X[i]), abs(X_new[i]))
+        e5 = 0.0
+        e3 = 0.0
+        for j in range(N_STAGES+1):
+            e5 += E5[j]*K[j, i]
+            e3 += E3[j]*K[j, i]
+        err5 += (e5/scale)**2
+        err3 += (e3/scale)**2
+    if err5 == 0 and err3 == 0:
+        return 0.0
+    return abs(h)*err5/np.sqrt((err5 + 0.01*err3)*n)
+
+
+@njit(cache=True)
+def propagate_dop853(X0, mu, T, atol, rtol, h0):
+    """ Adaptive DOP853 propagation evaluated at the times T
+
+    Steps are clipped to land exactly on the evaluation times.
+
+    Args:
+        X0 (array): Initial state [x,y,z,vx,vy,vz]
+        mu (float): mass ratio (m2)/(m1+m2)
+        T (array): Increasing evaluation times, T[0] is the initial time
+        atol, rtol (float): Absolute and relative tolerances
+        h0 (float): Initial step size
+
+    Returns:
+        X: numpy array of shape (6,len(T)). Samples after a failure of the
+            step size control (e.g. a collision) are NaN.
+        n_steps: number of accepted steps
+    """
+    X = np.full((6, len(T)), np.nan)
+    K = np.empty((N_STAGES+1, 6))
+    Y = np.empty(6)
+    f = np.empty(6)
+    new = np.empty(6)
+    state = X0.copy()
+    X[:, 0] = state
+    equation_of_motion(state, mu, f)
+
+    t = T[0]
+    h = h0
+    n_steps = 0
+    for k in range(1, len(T)):
+        while t < T[k]:
+            if h < 10*EPS*abs(t) or not np.isfinite(h):
+                return X, n_steps
+            step = min(h, T[k] - t)
+            rejected = False
+            while True:
+                dop853_step(state, mu, step, f, K, Y, new)
+                norm = dop853_error_norm(state, new, K, step, atol, rtol)
+                if norm < 1:
+                    if norm == 0:
+                        factor = MAX_FACTOR
+                    else:
+                        factor = min(MAX_FACTOR, SAFETY*norm**(-1/8))
+                    if rejected:
+                        factor = min(1.0, factor)
+                    break
+                step *= max(MIN_FACTOR, SAFETY*norm**(-1/8))
+                rejected = True
+                if step < 10*EPS*abs(t) or not np.isfinite(norm):
+                    return X, n_steps
+
+            clipped = t + step >= T[k]
+            t = T[k] if clipped else t + step
+            state[:] = new
+            f[:] = K[N_STAGES]
+            n_steps += 1
+            # A step clipped by an evaluation time does not shrink h
+            h = max(h, step*factor) if clipped else step*factor
+        X[:, k] = state
+    return X, n_steps
+
+
+@njit(cache=True)
+def henon_equation(X, mu, axis, dX):
+    """ Equations of motion with X[axis] as independent variable (Henon's trick)
+
+    Args:
+        X (array): Extended state [x,y,z,vx,vy,vz,t]
+        axis (int): index of the coordinate used as independent variable
+        dX (array): Output array for dX/dX[axis]
+    """
+    equation_of_motion(X, mu, dX)
+    rate = dX[axis]
+    for i in range(6):
+        dX[i] /= rate
+    dX[6] = 1/rate
+
+
+@njit(cache=True)
+def henon_step(X, mu, axis, ds):
+    """ RK8 step of length ds in the coordinate X[axis] from the state X
+
+    Returns:
+        X_new (array): Extended state [x,y,z,vx,vy,vz,dt] where dt is the
+            time elapsed during the step
+    """
+    K = np.empty((N_STAGES, 7))
+    Y = np.empty(7)
+    X_ext = np.zeros(7)
+    X_ext[:6] = X
+    henon_equation(X_ext, mu, axis, K[0])
+    for s in range(1, N_STAGES):
+        for i in range(7):
+            dy = 0.0
+            for j in range(s):
+                dy += A[s, j]*K[j, i]
+            Y[i] = X_ext[i] + ds*dy
+        henon_equation(Y, mu, axis, K[s])
+    X_new = np.empty(7)
+    for i in range(7):
+        dy = 0.0
+        for j in range(N_STAGES):
+            dy += B[j]*K[j, i]
+        X_new[i] = X_ext[i] + ds*dy
+    return X_new
+
+
+@njit(cache=True)
+def poincare_dop853(X0, mu, axis, value, direction, n_crossings, t_max,
+                    atol, rtol, h0):
+    """ Crossings of the plane X[axis] = value along an adaptive DOP853 orbit
+
+    Every crossing found between two steps is refined with one Henon step
+    from the end of the step back to the plane. Only the crossings are kept.
+
+    Args:
+        X0 (array): Initial state [x,y,z,vx,vy,vz]
+        mu (float): mass ratio (m2)/(m1+m2)
+        axis (int), value (float): plane X[axis] = value
+        direction (int): +1 (-1) only crossings with increasing (decreasing)
+            X[axis], 0 both
+        n_crossings (int): number of crossings after which the integration stops
+        t_max (float): maximum time of integration
+        atol, rtol (float): Absolute and relative tolerances
+        h0 (float): Initial step size
+
+    Returns:
+        crossings: numpy array of shape (n,7) with rows [t,x,y,z,vx,vy,vz], n <= n_crossings
+    """
+    crossings = np.empty((n_crossings, 7))
+    K = np.empty((N_STAGES+1, 6))
+    Y = np.empty(6)
+    f = np.empty(6)
+    new = np.empty(6)
+    state = X0.copy()
+    equation_of_motion(state, mu, f)
+
+    t = 0.0
+    h = h0
+    n = 0
+    while n < n_crossings and t < t_max:
+        step = min(h, t_max - t)
+        while True:
+            dop853_step(state, mu, step, f, K, Y, new)
+            norm = dop853_error_norm(state, new, K, step, atol, rtol)
+            if norm < 1:
+                break
+            step *= max(MIN_FACTOR, SAFETY*norm**(-1/8))
+            if step < 10*EPS*abs(t) or not np.isfinite(norm):
+                return crossings[:n]
+        factor = MAX_FACTOR if norm == 0 else min(MAX_FACTOR, SAFETY*norm**(-1/8))
+
+        g_old = state[axis] - value
+        g_new = new[axis] - value
+        t += step
+        state[:] = new
+        f[:] = K[N_STAGES]
+        h = step*factor
+
+        if (g_old < 0 <= g_new and direction >= 0) or (g_old > 0 >= g_new and direction <= 0):
+            cross = henon_step(state, mu, axis, -g_new)
+            crossings[n, 0] = t + cross[6]
+            crossings[n, 1:] = cross[:6]
+            crossings[n, 1+axis] = value
+            n += 1
+    return crossings[:n]
+
+
+# Extended state of the variational integration:
+# [x,y,z,vx,vy,vz, u (6), l, Y, W, t]
+N_VARIATIONAL = 16
+
+
+@njit(cache=True)
+def variational_equation(Z, mu, dZ):
+    """ Equations of motion with the normalized variational equations and the
+    accumulators of the chaos indicators
+
+    The deviation vector is integrated normalized, u = delta/|delta|, with
+    u' = J u - (u.J u) u and l' = u.J u, so l = ln(|delta|/|delta0|) and no
+    renormalization is needed. The MEGNO integrals are Y' = t u.J u and
+    W' = 2Y/t (Cincotta & Simo 2000).
+
+    Args:
+        Z (array): Extended state, see N_VARIATIONAL
+        mu (float): mass ratio (m2)/(m1+m2)
+        dZ (array): Output array for the time derivative of Z
+    """
+    equation_of_motion(Z, mu, dZ)
+    x, y, z = Z[0], Z[1], Z[2]
+    mu1 = 1-mu
+    mu2 = mu
+    dx1, dx2 = x+mu2, x-mu1
+    r1 = np.sqrt(dx1**2 + y**2 + z**2)
+    r2 = np.sqrt(dx2**2 + y**2 + z**2)
+    a1 = mu1/r1**3
+    a2 = mu2/r2**3
+    b1 = 3*mu1/r1**5
+    b2 = 3*mu2/r2**5
+
+    # Hessian of the effective potential
+    Uxx = 1 - a1 - a2 + b1*dx1**2 + b2*dx2**2
+    Uyy = 1 - a1 - a2 + (b1 + b2)*y**2
+    Uzz = -a1 - a2 + (b1 + b2)*z**2
+    Uxy = (b1*dx1 + b2*dx2)*y
+    Uxz = (b1*dx1 + b2*dx2)*z
+    Uyz = (b1 + b2)*y*z
+
+    u0, u1, u2, u3, u4, u5 = Z[6], Z[7], Z[8], Z[9], Z[10], Z[11]
+    du0 = u3
+    du1 = u4
+    du2 = u5
+    du3 = Uxx*u0 + Uxy*u1 + Uxz*u2 + 2*u4
+    du4 = Uxy*u0 + Uyy*u1 + Uyz*u2 - 2*u3
+    du5 = Uxz*u0 + Uyz*u1 + Uzz*u2
+    norm2 = u0**2 + u1**2 + u2**2 + u3**2 + u4**2 + u5**2
+    rate = (u0*du0 + u1*du1 + u2*du2 + u3*du3 + u4*du4 + u5*du5)/norm2
+
+    dZ[6] = du0 - rate*u0
+    dZ[7] = du1 - rate*u1
+    dZ[8] = du2 - rate*u2
+    dZ[9] = du3 - rate*u3
+    dZ[10] = du4 - rate*u4
+    dZ[11] = du5 - rate*u5
+    t = Z[15]
+    dZ[12] = rate
+    dZ[13] = rate*t
+    dZ[14] = 2*Z[13]/t if t > 0 else 0.0
+    dZ[15] = 1.0
+
+
+@njit(cache=True)
+def variational_step(Z, mu, h, f, K, Y, Z_new):
+    """ DOP853 step of the variational system (see dop853_step) """
+    K[0] = f
+    for s in range(1, N_STAGES):
+        for i in range(N_VARIATIONAL):
+            dy = 0.0
+            for j in range(s):
+                dy += A[s, j]*K[j, i]
+            Y[i] = Z[i] + h*dy
+        variational_equation(Y, mu, K[s])
+    for i in range(N_VARIATIONAL):
+        dy = 0.0
+        for j in range(N_STAGES):
+            dy += B[j]*K[j, i]
+        Z_new[i] = Z[i] + h*dy
+    variational_equation(Z_new, mu, K[N_STAGES])
+
+
+@njit(cache=True)
+def chaos_dop853(Z0, mu, t_max, R_escape, R_collision, atol, rtol, h0):
+    """ Adaptive DOP853 integration of the variational system up to t_max,
+    an escape or a collision
+
+    Args:
+        Z0 (array): Initial extended state (see N_VARIATIONAL)
+        mu (float): mass ratio (m2)/(m1+m2)
+        t_max (float): maximum time of integration
+        R_escape (float): escape radius around the barycenter
+        R_collision (float): collision radius around m1 and m2
+        atol, rtol (float): Absolute and relative tolerances
+        h0 (float): Initial step size
+
+    Returns:
+        Z: final extended state
+        fli: maximum of l along the integration (Fast Lyapunov Indicator)
+        status: 0 if t_max was reached, 1 escape, 2 collision (or failure of
+            the step size control)
+        n_steps: number of accepted steps
+    """
+    K = np.empty((N_STAGES+1, N_VARIATIONAL))
+    Y = np.empty(N_VARIATIONAL)
+    f = np.empty(N_VARIATIONAL)
+    new = np.empty(N_VARIATIONAL)
+    state = Z0.copy()
+    variational_equation(state, mu, f)
+
+    h = h0
+    fli = state[12]
+    n_steps = 0
+    while state[15] < t_max:
+        step = min(h, t_max - state[15])
+        while True:
+            variational_step(state, mu, step, f, K, Y, new)
+            norm = dop853_error_norm(state, new, K, step, atol, rtol)
+            if norm < 1:
+                break
+            step *= max(MIN_FACTOR, SAFETY*norm**(-1/8))
+            if step < 10*EPS*abs(state[15]) or not np.isfinite(norm):
+                return state, fli, 2, n_steps
+        factor = MAX_FACTOR if norm == 0 else min(MAX_FACTOR, SAFETY*norm**(-1/8))
+        state[:] = new
+        f[:] = K[N_STAGES]
+        h = step*factor
+        n_steps += 1
+        fli = max(fli, state[12])
+
+        x, y, z = state[0], state[1], state[2]
+        if x**2 + y**2 + z**2 > R_escape**2:
+            return state, fli, 1, n_steps
+        if ((x+mu)**2 + y**2 + z**2 < R_collision**2 or
+                (x-1+mu)**2 + y**2 + z**2 < R_collision**2):
+            return state, fli, 2, n_steps
+    return state, fli, 0, n_steps
@@ -0,0 +1,144 @@
+"""
+Poincare surfaces of section for the planar Circular Restricted Three Body Problem.
+
+Initial conditions are placed on the section plane at a given Jacobi
+constant, and only the crossings of every orbit with the plane are kept.
+Orbits are integrated in parallel with the compiled DOP853 loop of
+crtbp_jit (crossings refined with Henon's trick) or, without numba, with
+solve_ivp events.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.integrate import solve_ivp
+
+import crtbp_jit
+from crtbp import Crtbp
+
+# One row per crossing
+SECTION_DTYPE = np.dtype([('orbit', np.int32), ('t', np.float64),
+                          ('x', np.float64), ('y', np.float64),
+                          ('vx', np.float64), ('vy', np.float64)])
+
+AXES = {'x': 0, 'y': 1}
+
+
+def parse_plane(plane):
+    """Axis index and value of a plane written as "y=0" or "x=0.5" """
+    name, value = plane.replace(' ', '').split('=')
+    if name not in AXES:
+        raise ValueError(f'Not valid plane {plane}')
+    return AXES[name], float(value)
+
+
+def initial_conditions(jacobi, mu, plane="y=0", q0=None, p0=None,
+                       n_orbits=20, q_range=(-1.5, 1.5), direction=1):
+    """Planar initial states on a section plane with a given Jacobi constant
+
+    The section coordinates (q,p) are (x,vx) for a plane y=c and (y,vy) for
+    a plane x=c. The missing velocity is obtained by inverting Crtbp.get_Jacobi
+    (Crtbp.get_Jacobi_velocity) with the sign given by direction.
+
+    Args:
+        jacobi (float): Jacobi constant
+        mu (float): mass ratio (m2)/(m1+m2)
+        plane (str): section plane, "y=c" or "x=c"
+        q0, p0 (array): section coordinates of the orbits. By default
+            n_orbits values of q in q_range with p = 0.
+        direction (int): sign of the velocity crossing the plane
+
+    Returns:
+        X0: numpy array of shape (n,6). Points in the forbidden region are removed.
+    """
+    axis, value = parse_plane(plane)
+    other = 1 - axis
+    q0 = np.linspace(*q_range, n_orbits) if q0 is None else np.asarray(q0, dtype=float)
+    p0 = np.zeros_like(q0) if p0 is None else np.broadcast_to(p0, q0.shape)
+
+    X0 = np.zeros((len(q0), 6))
+    X0[:, axis] = value
+    X0[:, other] = q0
+    X0[:, 3+other] = p0
+    v = Crtbp.get_Jacobi_velocity(X0.T, jacobi, mu)
+    X0[:, 3+axis] = (direction or 1)*np.sqrt(v**2 - p0**2)
+    return X0[np.isfinite(X0[:, 3+axis])]
+
+
+def _equation_of_motion(t, X, mu):
+    dX = np.empty(6)
+    crtbp_jit.equation_of_motion(X, mu, dX)
+    return dX
+
+
+def _crossings_scipy(X0, mu, axis, value, direction, n_crossings, t_max):
+    def plane(t, X, mu): return X[axis] - value
+    plane.direction = direction
+    # The initial state lies on the plane and may be reported as a crossing
+    plane.terminal = n_crossings + 1
+
+    solution = solve_ivp(_equation_of_motion, t_span=[0, t_max], y0=X0, method='DOP853',
+                         atol=1e-11, rtol=1e-11, args=(mu,), events=plane)
+    later = solution.t_events[0] > 0
+    t_events = solution.t_events[0][later][:n_crossings]
+    X_events = solution.y_events[0].reshape((-1, 6))[later][:n_crossings]
+    return np.column_stack([t_events, X_events])
+
+
+def _run_orbits(indices, X0, mu, axis, value, direction, n_crossings, t_max, engine):
+    # X0 holds the initial states of the orbits indices only
+    rows = []
+    for i, x0 in zip(indices, X0):
+        if engine == "jit":
+            crossings = crtbp_jit.poincare_dop853(x0, mu, axis, value, direction,
+                                                  n_crossings, t_max, 1e-11, 1e-11, 1e-3)
+        else:
+            crossings = _crossings_scipy(x0, mu, axis, value, direction,
+                                         n_crossings, t_max)
+        section = np.empty(len(crossings), dtype=SECTION_DTYPE)
+        section['orbit'] = i
+        section['t'] = crossings[:, 0]
+        section['x'], section['y'] = crossings[:, 1], crossings[:, 2]
+        section['vx'], section['vy'] = crossings[:, 4], crossings[:, 5]
+        rows.append(section)
+    return np.concatenate(rows) if rows else np.empty(0, dtype=SECTION_DTYPE)
+
+
+def poincare_section(jacobi, mu, plane="y=0", n_crossings=200, n_orbits=20,
+                     q0=None, p0=None, q_range=(-1.5, 1.5), direction=1,
+                     t_max=1e4, processes=None, chunksize=4):
+    """Surface of section of the planar CRTBP at a given Jacobi constant
+
+    Args:
+        jacobi (float): Jacobi constant
+        mu (float): mass ratio (m2)/(m1+m2)
+        plane (str): section plane, "y=c" or "x=c"
+        n_crossings (int): crossings computed for every orbit
+        n_orbits, q0, p0, q_range: initial conditions (see initial_conditions)
+        direction (int): +1 (-1) only crossings with increasing (decreasing)
+            coordinate, 0 both
+        t_max (float): maximum time of integration of every orbit
+        processes (int): number of worker processes, 1 runs in this process
+        chunksize (int): number of orbits sent to a worker at once
+
+    Returns:
+        section: structured array with fields orbit, t, x, y, vx, vy (SECTION_DTYPE),
+            sorted by orbit and time; orbit is the row of the returned X0
+        X0: initial states of the orbits, shape (n,6) with n <= n_orbits, as
+            initial_conditions removes the points in the forbidden region
+    """
+    axis, value = parse_plane(plane)
+    X0 = initial_conditions(jacobi, mu, plane, q0, p0, n_orbits, q_range, direction)
+    engine = "jit" if crtbp_jit.AVAILABLE else "scipy"
+    args = (mu, axis, value, direction, n_crossings, t_max, engine)
+
+    chunks = [range(i, min(i+chunksize, len(X0))) for i in range(0, len(X0), chunksize)]
+    states = [X0[chunk.start:chunk.stop] for chunk in chunks]
+    if processes == 1:
+        sections = [_run_orbits(chunk, x0, *args) for chunk, x0 in zip(chunks, states)]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            sections = list(pool.map(_run_orbits, chunks, states,
+                                     *[[arg]*len(chunks) for arg in args]))
+
+    section = np.concatenate(sections) if sections else np.empty(0, dtype=SECTION_DTYPE)
+    return section, X0
@@ -0,0 +1,159 @@
+"""
+Cached grids of the effective potential of the Circular Restricted Three Body Problem.
+
+A PotentialGrid evaluates CJ(x,y) = x^2 + y^2 + 2(mu1/r1 + mu2/r2) once on a
+rectilinear grid of the plane z = 0. Zero velocity curves of any Jacobi
+constant are contours of that single array, and the surface -CJ(x,y) of the
+notebook animations is served from it as well. Grids may be refined with
+extra nodes around the primaries and the Lagrange points. get_grid keeps
+the grids in an LRU cache keyed by (mu, extent, resolution, refine) with a
+memory budget.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PotentialGrid():
+    """Effective potential CJ(x,y) on a rectilinear grid
+
+    Args:
+        mu (float): mass ratio (m2)/(m1+m2)
+        extent (tuple): (xmin, xmax, ymin, ymax)
+        resolution (int or tuple): number of uniform nodes in x and y
+        refine (int): extra nodes added in every axis around the primaries and
+            the Lagrange points (0 for a uniform grid)
+        width (float): half width of the refined windows
+    """
+    def __init__(self, mu, extent=(-1.5, 1.5, -1.5, 1.5), resolution=100, refine=0, width=0.05):
+        self.mu = mu
+        self.extent = tuple(extent)
+        self.resolution = tuple(np.broadcast_to(resolution, 2))
+        self.refine = refine
+
+        xmin, xmax, ymin, ymax = self.extent
+        self.x = np.linspace(xmin, xmax, self.resolution[0])
+        self.y = np.linspace(ymin, ymax, self.resolution[1])
+        if refine:
+            x_features, y_features = _features(mu)
+            self.x = _refine_axis(self.x, x_features, refine, width)
+            self.y = _refine_axis(self.y, y_features, refine, width)
+
+        self.X, self.Y = np.meshgrid(self.x, self.y)
+        mu1 = 1-mu
+        mu2 = mu
+        with np.errstate(divide='ignore'):
+            r1 = np.sqrt((self.X+mu2)**2+self.Y**2)
+            r2 = np.sqrt((self.X-mu1)**2+self.Y**2)
+            self.CJ = self.X**2+self.Y**2+2*(mu1/r1+mu2/r2)
+
+    @property
+    def nbytes(self):
+        return self.X.nbytes + self.Y.nbytes + self.CJ.nbytes
+
+    def forbidden(self, CJ):
+        """Mask of the forbidden region(s), shape (ny,nx) or (len(CJ),ny,nx) for an array of constants"""
+        CJ = np.asarray(CJ, dtype=float)
+        return self.CJ < CJ[..., None, None]
+
+    def zero_velocity(self, ax, CJ, filled=True, **kwargs):
+        """Zero velocity curves of one or several Jacobi constants on a matplotlib axis
+
+        Args:
+            ax: matplotlib axis
+            CJ (float or array): Jacobi constants
+            filled (bool): also shade the forbidden region of the largest constant
+            kwargs: passed to ax.contour
+
+        Returns:
+            lines: matplotlib contour set
+        """
+        levels = np.unique(np.atleast_1d(CJ))
+        kwargs.setdefault('colors', 'k')
+        kwargs.setdefault('alpha', 0.3)
+        if filled:
+            ax.contourf(self.x, self.y, self.CJ, levels=[-100, levels[-1]],
+                        colors=kwargs['colors'], alpha=kwargs['alpha'])
+        return ax.contour(self.x, self.y, self.CJ, levels=levels, **kwargs)
+
+    def surface(self, clip=6):
+        """X, Y and -CJ for a 3D surface plot, NaN where CJ > clip (near the primaries)"""
+        return self.X, self.Y, np.where(self.CJ > clip, np.nan, -self.CJ)
+
+
+def _features(mu):
+    # Coordinates of the primaries and the Lagrange points
+    from crtbp import Crtbp
+    L = Crtbp.Lagrange(mu)
+    x = [-mu, 1-mu, L[0], L[1], L[2], L[3][0]]
+    y = [0, L[3][1], L[4][1]]
+    return x, y
+
+
+def _refine_axis(axis, features, n, width):
+    # Add n nodes in [f-width, f+width] around every feature inside the axis
+    lo, hi = axis[0], axis[-1]
+    extra = [np.linspace(f-width, f+width, n) for f in features if lo <= f <= hi]
+    axis = np.unique(np.concatenate([axis] + extra))
+    return axis[(axis >= lo) & (axis <= hi)]
+
+
+class GridCache():
+    """
+    LRU cache of PotentialGrid keyed on (mu, extent, resolution, refine)
+
+    Args:
+        max_bytes (int): memory budget, the least recently used grids are
+            evicted when the grids in the cache use more than max_bytes
+    """
+    def __init__(self, max_bytes=256*2**20):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def key(self, mu, extent, resolution, refine):
+        return (float(mu), tuple(map(float, extent)),
+                tuple(map(int, np.broadcast_to(resolution, 2))), int(refine))
+
+    def get(self, mu, extent, resolution, refine):
+        key = self.key(mu, extent, resolution, refine)
+        if key in self.data:
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+
+        self.misses += 1
+        grid = PotentialGrid(mu, extent, resolution, refine)
+        self.data[key] = grid
+        while self.nbytes > self.max_bytes and len(self.data) > 1:
+            self.data.popitem(last=False)
+            self.evictions += 1
+        return grid
+
+    @property
+    def nbytes(self):
+        return sum(grid.nbytes for grid in self.data.values())
+
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    size=len(self.data), nbytes=self.nbytes, max_bytes=self.max_bytes)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+# Cache shared by get_grid and Crtbp.plot_trayectory
+cache = GridCache()
+
+
+def configure_cache(max_bytes=256*2**20):
+    """Replace the shared cache (stored grids are dropped)"""
+    global cache
+    cache = GridCache(max_bytes)
+    return cache
+
+
+def get_grid(mu, extent=(-1.5, 1.5, -1.5, 1.5), resolution=100, refine=0):
+    """PotentialGrid from the shared cache, computed on the first request"""
+    return cache.get(mu, extent, resolution, refine)
@@ -0,0 +1,190 @@
+"""
+Incremental rendering of CRTBP animations.
+
+The static part of a frame (axes, primaries in the synodic frame, zero
+velocity curves) is drawn once and kept as a background; every frame only
+restores the background and draws the moving artists (blitting). Frames are
+streamed as raw RGBA to an ffmpeg process, so no frame is kept in memory.
+Long animations are split in segments rendered by separate processes and
+joined with ffmpeg's concat demuxer.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from crtbp import Crtbp
+import potential
+
+
+class OrbitAnimation():
+    """Animation of a propagated orbit
+
+    Args:
+        X (array): Trajectory in the synodic frame, shape (6,N) (Crtbp.propagate)
+        T (array): Times, shape (N,)
+        mu (float): mass ratio (m2)/(m1+m2)
+        inertial (bool): draw the orbit in the inertial frame (Crtbp.Syn2Ine),
+            the primaries then move
+        trail (int): number of previous samples drawn behind the particle,
+            None for the whole orbit
+        zero_curve (bool): shade the forbidden region of the Jacobi constant
+            of the orbit (synodic frame only)
+        step (int): samples between frames
+        extent (tuple): (xmin, xmax, ymin, ymax), by default the orbit limits
+        figsize, dpi: size of the frames, rounded to an even number of pixels
+            (yuv420p video needs even dimensions)
+    """
+    def __init__(self, X, T, mu, inertial=False, trail=None, zero_curve=False, step=1,
+                 extent=None, figsize=(6, 6), dpi=100):
+        self.T = np.asarray(T, dtype=float)
+        self.mu = mu
+        self.inertial = inertial
+        self.trail = trail
+        self.zero_curve = zero_curve
+        self.step = step
+        self.figsize = figsize
+        self.dpi = dpi
+        X = np.asarray(X, dtype=float)
+        if inertial:
+            self.R1, self.R2, X = Crtbp.Syn2Ine(X, self.T, mu)
+        self.X = X
+        if extent is None:
+            r = 1.1*max(np.nanmax(np.abs(X[:2])), 1)
+            extent = (-r, r, -r, r)
+        self.extent = extent
+
+    def __len__(self):
+        return (len(self.T) - 1)//self.step + 1
+
+    @property
+    def size(self):
+        """Width and height of the frames in pixels, as rendered by the canvas"""
+        return FigureCanvasAgg(self._figure()).get_width_height()
+
+    def _figure(self):
+        # Even pixel sizes; Agg truncates width*dpi, so half a pixel is added
+        # to keep values such as 5.99999 inches from losing a pixel
+        pixels = [2*max(1, int(round(v*self.dpi/2))) for v in self.figsize]
+        return Figure(figsize=[(p + 0.5)/self.dpi for p in pixels], dpi=self.dpi)
+
+    def _setup(self):
+        fig = self._figure()
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        ax.set_xlim(*self.extent[:2])
+        ax.set_ylim(*self.extent[2:])
+        ax.set_aspect('equal')
+        ax.set_xlabel('x')
+        ax.set_ylabel('y')
+
+        if not self.inertial:
+            ax.plot(-self.mu, 0, 'ro', markersize=5)
+            ax.plot(1-self.mu, 0, 'bo', markersize=5)
+            if self.zero_curve:
+                grid = potential.get_grid(self.mu, extent=self.extent, resolution=200)
+                ax.contourf(grid.x, grid.y, grid.CJ, colors='k', alpha=0.2,
+                            levels=[-100, Crtbp.get_Jacobi(self.X[:, 0], self.mu)])
+
+        moving = dict(
+            trail=ax.plot([], [], 'k-', lw=0.8, animated=True)[0],
+            particle=ax.plot([], [], 'ko', markersize=4, animated=True)[0],
+            time=ax.text(0.02, 0.95, '', transform=ax.transAxes, animated=True),
+        )
+        if self.inertial:
+            moving['m1'] = ax.plot([], [], 'ro', markersize=5, animated=True)[0]
+            moving['m2'] = ax.plot([], [], 'bo', markersize=5, animated=True)[0]
+
+        # The static background is rasterized once
+        canvas.draw()
+        background = canvas.copy_from_bbox(fig.bbox)
+        return fig, canvas, ax, background, moving
+
+    def frames(self, start=0, stop=None):
+        """Generator of the frames [start, stop) as (height, width, 4) uint8 RGBA arrays
+
+        The yielded array is the canvas buffer, it is overwritten by the next frame.
+        """
+        fig, canvas, ax, background, moving = self._setup()
+        stop = len(self) if stop is None else min(stop, len(self))
+        for frame in range(start, stop):
+            i = frame*self.step
+            first = 0 if self.trail is None else max(0, i - self.trail)
+
+            canvas.restore_region(background)
+            moving['trail'].set_data(self.X[0, first:i+1], self.X[1, first:i+1])
+            moving['particle'].set_data(self.X[0, i:i+1], self.X[1, i:i+1])
+            moving['time'].set_text(f't = {self.T[i]:.2f}')
+            if self.inertial:
+                moving['m1'].set_data(self.R1[0, i:i+1], self.R1[1, i:i+1])
+                moving['m2'].set_data(self.R2[0, i:i+1], self.R2[1, i:i+1])
+            for artist in moving.values():
+                ax.draw_artist(artist)
+            canvas.blit(fig.bbox)
+            yield np.asarray(canvas.buffer_rgba())
+
+    def save(self, path, fps=30, processes=1, codec='libx264', ffmpeg=None):
+        """Render the animation to a video file through ffmpeg
+
+        Args:
+            path (str): output file (e.g. resources/animations/orbit.mp4)
+            fps (int): frames per second
+            processes (int): number of processes; with more than one the
+                frames are split in segments rendered in parallel and joined
+                without re-encoding
+            codec (str): ffmpeg video codec
+            ffmpeg (str): ffmpeg executable, by default matplotlib's
+                rcParams['animation.ffmpeg_path']
+        """
+        ffmpeg = ffmpeg or matplotlib.rcParams['animation.ffmpeg_path']
+        n = len(self)
+        processes = max(1, min(processes or os.cpu_count(), n))
+        if processes == 1:
+            _write_segment(self, 0, n, path, fps, codec, ffmpeg)
+            return path
+
+        directory = tempfile.mkdtemp(prefix='render')
+        try:
+            edges = np.linspace(0, n, processes + 1).astype(int)
+            ext = os.path.splitext(path)[1] or '.mp4'
+            segments = [os.path.join(directory, f'segment{k:04d}{ext}') for k in range(processes)]
+            with ProcessPoolExecutor(processes) as pool:
+                list(pool.map(_write_segment, [self]*processes, edges[:-1], edges[1:], segments,
+                              [fps]*processes, [codec]*processes, [ffmpeg]*processes))
+
+            listing = os.path.join(directory, 'segments.txt')
+            with open(listing, 'w') as f:
+                f.writelines(f"file '{segment}'\n" for segment in segments)
+            subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                            '-i', listing, '-c', 'copy', path], check=True)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return path
+
+
+def _write_segment(animation, start, stop, path, fps, codec, ffmpeg):
+    # Frames [start, stop) piped to ffmpeg as raw RGBA
+    width, height = animation.size
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+               '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+               '-c:v', codec, '-pix_fmt', 'yuv420p', path]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for frame in animation.frames(start, stop):
+            process.stdin.write(frame.tobytes())
+    finally:
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f'ffmpeg failed writing {path}')
+    return path
+
+
+def render(X, T, mu, path, fps=30, processes=1, **kwargs):
+    """Render a propagated orbit to a video file (see OrbitAnimation and OrbitAnimation.save)"""
+    return OrbitAnimation(X, T, mu, **kwargs).save(path, fps=fps, processes=processes)
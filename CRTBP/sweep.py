@@ -0,0 +1,238 @@
+"""
+Parallel parameter sweeps for the Circular Restricted Three Body Problem.
+
+Every task of a sweep is one Crtbp propagation with its own mu and initial
+state. Tasks are distributed in chunks over a process pool; workers write
+their results into shared memory arrays and the main process flushes every
+finished chunk to .npy files, so an interrupted sweep can be resumed.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from crtbp import Crtbp
+
+# Orbit classes
+PENDING = -1
+BOUND = 0
+ESCAPE = 1
+COLLISION = 2
+OTHER = 3
+CLASSES = {PENDING: 'pending', BOUND: 'bound to m2', ESCAPE: 'escape',
+           COLLISION: 'collision', OTHER: 'other'}
+# Terminal events of Crtbp.propagate_events
+STOP_CLASSES = {'m1': COLLISION, 'm2': COLLISION, 'escape': ESCAPE}
+
+# Result arrays: name -> (dtype, shape of each row, initial value)
+FIELDS = {
+    'status': (np.int8, (), PENDING),
+    'final': (np.float64, (6,), np.nan),
+    'drift': (np.float64, (), np.nan),
+    'timing': (np.float64, (), np.nan),
+}
+
+
+def make_grid(mu, x, CJ):
+    """Grid of planar initial states on the x axis with given Jacobi constants
+
+    The particle starts at (x,0,0) moving along +y with the speed given by
+    Crtbp.get_Jacobi_velocity.
+
+    Args:
+        mu (array): mass ratios
+        x (array): initial positions on the x axis
+        CJ (array): Jacobi constants
+
+    Returns:
+        mu: array of shape (M,) with the mass ratio of each task
+        X0: array of shape (M,6) with the initial state of each task.
+            Points in the forbidden region are removed.
+    """
+    MU, XX, CC = (A.ravel() for A in np.meshgrid(mu, x, CJ, indexing='ij'))
+    zeros = np.zeros_like(XX)
+    vy = Crtbp.get_Jacobi_velocity([XX, zeros, zeros], CC, MU)
+    allowed = np.isfinite(vy)
+
+    X0 = np.zeros((allowed.sum(), 6))
+    X0[:, 0] = XX[allowed]
+    X0[:, 4] = vy[allowed]
+    return MU[allowed], X0
+
+
+def classify(X, mu, R_collision=1e-3, R_escape=5):
+    """Classify a propagated orbit
+
+    Args:
+        X (array): Trajectory, shape (6,dt)
+        mu (float): mass ratio (m2)/(m1+m2)
+        R_collision (float): collision radius around m1 and m2
+        R_escape (float): escape radius around the barycenter
+
+    Returns:
+        status (int): COLLISION or ESCAPE (whatever happens first), BOUND if
+            the orbit never leaves the Hill sphere of m2 (Crtbp.get_RHill),
+            OTHER otherwise
+    """
+    x, y, z = X[:3]
+    r1 = np.sqrt((x+mu)**2 + y**2 + z**2)
+    r2 = np.sqrt((x-1+mu)**2 + y**2 + z**2)
+    r = np.sqrt(x**2 + y**2 + z**2)
+
+    # Failed integrations (NaN) are collisions
+    collision = ~((r1 >= R_collision) & (r2 >= R_collision))
+    escape = r > R_escape
+    n = X.shape[1]
+    i_collision = np.argmax(collision) if collision.any() else n
+    i_escape = np.argmax(escape) if escape.any() else n
+
+    if i_collision < n or i_escape < n:
+        return COLLISION if i_collision <= i_escape else ESCAPE
+    if (r2 < Crtbp.get_RHill(mu)).all():
+        return BOUND
+    return OTHER
+
+
+def _arrays(blocks, n_tasks):
+    return {field: np.ndarray((n_tasks,) + FIELDS[field][1], dtype=FIELDS[field][0],
+                              buffer=block.buf)
+            for field, block in blocks.items()}
+
+
+def _run_chunk(names, n_tasks, indices, mu, X0, t, dt, engine, R_collision, R_escape):
+    # mu and X0 hold only the tasks of the chunk, results are written back by index
+    blocks = {field: shared_memory.SharedMemory(name=name)
+              for field, name in names.items()}
+    results = _arrays(blocks, n_tasks)
+    try:
+        for k, i in enumerate(indices):
+            start = time.perf_counter()
+            system = Crtbp(X0[k], mu[k])
+            if engine == "scipy":
+                # Collisions and escapes stop the integration
+                X, _, _, stop = system.propagate_events(
+                    t, dt, R_collision=R_collision, R_escape=R_escape)
+                status = STOP_CLASSES.get(stop)
+            else:
+                X, _ = system.propagate(t, dt, engine=engine)
+                status = None
+            if status is None:
+                status = classify(X, mu[k], R_collision, R_escape)
+            jacobi = Crtbp.get_Jacobi(X, mu[k])
+
+            results['status'][i] = status
+            results['final'][i] = X[:, -1]
+            results['drift'][i] = np.nanmax(np.abs(jacobi - system.jacobi))
+            results['timing'][i] = time.perf_counter() - start
+    finally:
+        del results
+        for block in blocks.values():
+            block.close()
+    return indices
+
+
+def _open_output(output, mu, X0):
+    """Open (or create) the .npy result files of a sweep in the directory output"""
+    os.makedirs(output, exist_ok=True)
+    grid = os.path.join(output, 'grid.npz')
+    if os.path.exists(grid):
+        saved = np.load(grid)
+        if not (np.array_equal(saved['mu'], mu) and np.array_equal(saved['X0'], X0)):
+            raise ValueError(f'{output} holds the results of a different grid')
+    else:
+        np.savez(grid, mu=mu, X0=X0)
+
+    files = {}
+    for field, (dtype, shape, fill) in FIELDS.items():
+        path = os.path.join(output, f'{field}.npy')
+        if os.path.exists(path):
+            files[field] = np.load(path, mmap_mode='r+')
+        else:
+            files[field] = np.lib.format.open_memmap(
+                path, mode='w+', dtype=dtype, shape=(len(mu),) + shape)
+            files[field][:] = fill
+    return files
+
+
+def sweep(mu, X0, t, dt=200, output=None, processes=None, chunksize=16,
+          engine="scipy", R_collision=1e-3, R_escape=5, verbose=True):
+    """Propagate and classify a grid of orbits over a process pool
+
+    Args:
+        mu (array): mass ratio of each task, shape (M,)
+        X0 (array): initial state of each task, shape (M,6)
+        t (float): Time of Integration
+        dt (int): number of samples of each orbit used for the classification
+        output (str): directory where results are stored. If it holds a
+            partial run of the same grid, only the pending tasks are computed.
+        processes (int): number of worker processes (default os.cpu_count())
+        chunksize (int): number of tasks sent to a worker at once
+        engine (str): engine of Crtbp.propagate ("scipy" or "jit"). With
+            "scipy" collisions and escapes are detected as events that stop
+            the integration.
+        R_collision, R_escape (float): radii used by classify
+        verbose (bool): print the progress and timing summary
+
+    Returns:
+        results (dict): arrays 'status' (M,), 'final' (M,6), 'drift' (M,)
+            with the maximum Jacobi constant error and 'timing' (M,) with
+            the wall time of every task in seconds
+    """
+    mu = np.asarray(mu, dtype=float)
+    X0 = np.asarray(X0, dtype=float).reshape((-1, 6))
+    if len(mu) != len(X0):
+        raise ValueError('mu and X0 must have the same number of tasks')
+    n_tasks = len(mu)
+
+    files = _open_output(output, mu, X0) if output else None
+    pending = (np.nonzero(files['status'] == PENDING)[0] if files
+               else np.arange(n_tasks))
+
+    blocks = {}
+    shared = None
+    try:
+        for field, (dtype, shape, fill) in FIELDS.items():
+            size = max(1, n_tasks*int(np.prod(shape))*np.dtype(dtype).itemsize)
+            blocks[field] = shared_memory.SharedMemory(create=True, size=size)
+        names = {field: block.name for field, block in blocks.items()}
+        shared = _arrays(blocks, n_tasks)
+        for field, (dtype, shape, fill) in FIELDS.items():
+            shared[field][:] = files[field] if files else fill
+
+        chunks = [pending[i:i+chunksize] for i in range(0, len(pending), chunksize)]
+        start = time.perf_counter()
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(_run_chunk, names, n_tasks, chunk, mu[chunk], X0[chunk],
+                                   t, dt, engine, R_collision, R_escape)
+                       for chunk in chunks]
+            for n_done, future in enumerate(as_completed(futures), 1):
+                indices = future.result()
+                if files:
+                    for field in FIELDS:
+                        files[field][indices] = shared[field][indices]
+                        files[field].flush()
+                if verbose:
+                    print(f'\rchunk {n_done}/{len(chunks)}', end='', flush=True)
+        wall = time.perf_counter() - start
+
+        results = {field: shared[field].copy() for field in FIELDS}
+    finally:
+        # Views of the shared memory must be released before closing it
+        shared = None
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+
+    if verbose:
+        timing = results['timing'][pending]
+        print(f'\n{len(pending)} tasks ({n_tasks-len(pending)} resumed) in {wall:.2f} s')
+        if len(pending):
+            print(f'task time: mean {timing.mean():.3f} s, max {timing.max():.3f} s, '
+                  f'total {timing.sum():.2f} s')
+        for status, label in CLASSES.items():
+            count = (results['status'] == status).sum()
+            if count:
+                print(f'  {label}: {count}')
+    return results
@@ -25,29 +25,33 @@ label.place(x=20, y=230)
 entry = CTkEntry(main, width=50, height=20, validate='key')
 entry.place(x=100, y=235)
 
-def plot():
+fig = Figure(figsize=(5, 4))
+ax = fig.add_subplot(111)
+line, = ax.plot([], [])
+
+#The canvas and the toolbar are created once, plot only updates the line
+canvas = FigureCanvasTkAgg(fig, master=root)
+canvas.draw()
+canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=1)
 
-    fig = Figure(figsize=(5, 4))
-    ax = fig.add_subplot(111)
+toolbar = NavigationToolbar2Tk(canvas, root)
+toolbar.update()
+canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=1)
+
+t = np.linspace(0, 2*np.pi, 200)
+
+def plot():
 
     try:
         w = float(entry.get())
     except:
         messagebox.showerror('Missing Value', 'Some value not well defined')
-            
-
-    t = np.linspace(0, 2*np.pi, 200)
-    values = np.sin(w*t)     
-        
-    ax.plot(t, values)
-
-    canvas = FigureCanvasTkAgg(fig, master=root)
-    canvas.draw()
-    canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=1)
+        return
 
-    toolbar = NavigationToolbar2Tk(canvas, root)
-    toolbar.update()
-    canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=1)
+    line.set_data(t, np.sin(w*t))
+    ax.relim()
+    ax.autoscale_view()
+    canvas.draw_idle()
 
 button = CTkButton(master=main, text="Plot", command=plot)
 button.place(relx=0.5, rely=0.5, anchor=tkinter.CENTER)
@@ -1,6 +1,7 @@
 #clase que genera una elipse centrada en el origen con los focos sobre el eje x
 import numpy as np
 from scipy.optimize import newton
+from scipy.special import hyp2f1
 
 class Ellipse(): 
     """
@@ -101,6 +102,129 @@ class Ellipse():
         return point1, point2
     
 
+class EllipseBatch():
+    """
+    Array version of Ellipse: N ellipses centered in the origin with the focus on the x axis
+
+    Parameters:
+        a: array (N):
+            semi mayor axes
+        e: array (N):
+            eccentricities
+        or
+        b: array (N):
+            semi minor axes
+        n_points: int (200):
+            default number of points of get_points
+
+    The cosines and sines of the sampled angles are shared by all the
+    instances (one table per number of points), so get_points only
+    multiplies them by a and b.
+    """
+    #Status of get_focus
+    TWO = 0  #two intersections
+    TANGENT = 1  #one intersection, point1 = point2
+    SEPARATE = 2  #no intersection, point1 = point2 on the radical axis and the line of centers
+    CONCENTRIC = 3  #same center, point1 = point2 = center1
+
+    _unit_circle = {}
+
+    def __init__(self, a, e = None, b = None, n_points = 200):
+        if e is not None:
+            self.a, self.e = (np.atleast_1d(np.asarray(v, dtype=float)) for v in np.broadcast_arrays(a, e))
+            self.b = self.a*np.sqrt(1 - self.e**2)
+        elif b is not None:
+            self.a, self.b = (np.atleast_1d(np.asarray(v, dtype=float)) for v in np.broadcast_arrays(a, b))
+            self.e = np.sqrt(1 - self.b**2/self.a**2)
+        else:
+            raise ValueError('Give the eccentricities e or the semi minor axes b')
+        self.c = np.sqrt(self.a**2 - self.b**2)
+        self.focus = np.column_stack([self.c, np.zeros_like(self.c)])
+        self.vacant_focus = np.column_stack([-self.c, np.zeros_like(self.c)])
+        self.n_points = n_points
+
+    def __len__(self):
+        return len(self.a)
+
+    @classmethod
+    def unit_circle(cls, n_points):
+        #Cached cos and sin of n_points angles in [0, 2pi]
+        if n_points not in cls._unit_circle:
+            theta = np.linspace(0, 2*np.pi, n_points)
+            cls._unit_circle[n_points] = (np.cos(theta), np.sin(theta))
+        return cls._unit_circle[n_points]
+
+    def get_points(self, n_points = None, out = None):
+        """
+        Points of all the ellipses
+
+        Parameters:
+            n_points: int:
+                number of points of every ellipse (default self.n_points)
+            out: array (N, n_points, 2):
+                array where the points are written, reused between calls
+
+
+        Return:
+            points: array (N, n_points, 2)
+        """
+        n_points = n_points or self.n_points
+        cos, sin = self.unit_circle(n_points)
+        if out is None:
+            out = np.empty((len(self.a), n_points, 2))
+        np.multiply(self.a[:, None], cos, out=out[:, :, 0])
+        np.multiply(self.b[:, None], sin, out=out[:, :, 1])
+        return out
+
+    @staticmethod
+    def get_focus(center1, center2, radio1, radio2, tol = 1e-12):
+        """
+        Intersections of N pairs of circles (Ellipse.get_focus for arrays)
+
+        Parameters:
+            center1, center2: array (N, 2):
+                centers of the circles
+            radio1, radio2: array (N):
+                radii of the circles
+            tol: float:
+                relative tolerance to consider two circles tangent
+
+
+        Return:
+            point1, point2: arrays (N, 2):
+                intersections, see the status for tangent and degenerate cases
+            status: int array (N):
+                EllipseBatch.TWO, TANGENT, SEPARATE or CONCENTRIC
+        """
+        c1 = np.atleast_2d(np.asarray(center1, dtype=float))
+        c2 = np.atleast_2d(np.asarray(center2, dtype=float))
+        r1, r2 = np.broadcast_arrays(np.atleast_1d(np.asarray(radio1, dtype=float)),
+                                     np.atleast_1d(np.asarray(radio2, dtype=float)))
+
+        delta = c2 - c1
+        d = np.hypot(delta[:, 0], delta[:, 1])
+        concentric = d <= tol*np.maximum(r1, r2)
+        d_safe = np.where(concentric, 1, d)
+        a = (r1**2 - r2**2 + d**2)/(2*d_safe)
+        dx, dy = delta[:, 0]/d_safe, delta[:, 1]/d_safe
+        h2 = r1**2 - a**2
+
+        scale = tol*np.maximum(r1, r2)**2
+        status = np.where(concentric, EllipseBatch.CONCENTRIC,
+                          np.where(h2 > scale, EllipseBatch.TWO,
+                                   np.where(h2 >= -scale, EllipseBatch.TANGENT, EllipseBatch.SEPARATE)))
+        h = np.sqrt(np.maximum(h2, 0))
+        #Without intersection the point on the line of centers is kept (h = 0)
+        h = np.where(status == EllipseBatch.TWO, h, 0)
+
+        px = c1[:, 0] + a*dx
+        py = c1[:, 1] + a*dy
+        point1 = np.column_stack([px + h*dy, py - h*dx])
+        point2 = np.column_stack([px - h*dy, py + h*dx])
+        point1[concentric] = point2[concentric] = c1[concentric]
+        return point1, point2, status
+
+
 def LambertProblem(r1, r2, theta, a = None, t = None):
     """
     LambertProblem solve the Lamnbert Equation given a value of semi mayor axis or a value of time
@@ -157,14 +281,166 @@ def LambertProblem(r1, r2, theta, a = None, t = None):
 
         return t1, t2
 
-    
-
-
-    
-
-
 
+def _lambert_tof(x, lam, M):
+    """
+    Non dimensional time of flight T(x) of Izzo's formulation and its first three derivatives
 
+    Parameters:
+        x: array:
+            Izzo's variable, x**2 = 1 - s/(2a)
+        lam: array:
+            lambda = +-sqrt(1 - c/s), negative for the long way
+        M: array:
+            number of complete revolutions
+    """
+    omx2 = 1 - x**2
+    y = np.sqrt(1 - lam**2*omx2)
+
+    #Battin's series near the parabola, Lagrange's equation elsewhere
+    near = np.abs(x - 1) < 0.01
+    eta = y - lam*x
+    S1 = 0.5*(1 - lam - x*eta)
+    Q = 4/3*hyp2f1(3, 1, 5/2, np.where(near, S1, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        T_series = (eta**3*Q + 4*lam*eta)/2 + M*np.pi/np.abs(omx2)**1.5
+        psi = np.where(x < 1, np.arccos(np.clip(x*y + lam*omx2, -1, 1)),
+                       np.arccosh(np.maximum(x*y - lam*x**2 + lam, 1)))
+        T_lagrange = ((psi + M*np.pi)/np.sqrt(np.abs(omx2)) - x + lam*y)/omx2
+        T = np.where(near, T_series, T_lagrange)
+
+        dT = (3*T*x - 2 + 2*lam**3*x/y)/omx2
+        ddT = (3*T + 5*x*dT + 2*(1 - lam**2)*lam**3/y**3)/omx2
+        dddT = (7*x*ddT + 8*dT - 6*(1 - lam**2)*lam**5*x/y**5)/omx2
+    return T, dT, ddT, dddT
+
+def _householder(x, T, lam, M, tol, maxiter):
+    #Householder iterations on T(x) = T with per element convergence, x is modified in place
+    iterations = np.zeros(x.shape, dtype=int)
+    converged = np.zeros(x.shape, dtype=bool)
+    active = np.flatnonzero(np.isfinite(x))
+    xf, Tf, lamf, Mf = x.ravel(), T.ravel(), lam.ravel(), M.ravel()
+    for _ in range(maxiter):
+        if active.size == 0:
+            break
+        xa = xf[active]
+        Tx, dT, ddT, dddT = _lambert_tof(xa, lamf[active], Mf[active])
+        delta = Tx - Tf[active]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = delta*(dT**2 - delta*ddT/2)/(dT*(dT**2 - delta*ddT) + dddT*delta**2/6)
+        #Keep x inside the domain x > -1 (halfway to the boundary)
+        x_new = np.where(xa - step > -1, xa - step, (xa - 1)/2)
+        xf[active] = x_new
+        iterations.ravel()[active] += 1
+
+        done = np.abs(step) < tol
+        converged.ravel()[active[done]] = True
+        active = active[~done & np.isfinite(x_new)]
+    return x, iterations, converged
+
+
+def LambertBatch(r1, r2, theta, t, M=0, branch="left", tol=1e-12, maxiter=35, x0=None):
+    """
+    Vectorized solution of the Lambert problem (semi mayor axis from the transfer time)
+    with Izzo's formulation (Izzo 2015) and Householder iterations in array form.
+    Units as in LambertProblem (GM = 1).
 
+    Parameters:
+        r1: array:
+            Distance point one to focus
+        r2: array:
+            Distance point two to focus
+        theta: array:
+            Angle between r1 and r2 in [0, 2pi), the transfer is the long way if theta > pi
+        t: array:
+            transfer time
+        M: int array (0):
+            number of complete revolutions
+        branch: "left" or "right" (or boolean array, True for "right"):
+            which of the two multi revolution solutions (M > 0) is returned,
+            x below or above the x of minimum time of flight (Izzo 2015)
+        tol: float:
+            convergence tolerance on Izzo's variable x
+        maxiter: int:
+            maximum number of iterations
+        x0: array or None:
+            initial guess of Izzo's variable x (e.g. the solution of a neighbouring
+            problem), NaN entries and multi revolution guesses on the wrong
+            branch use the default guess
 
 
+    Return:
+        a: array:
+            semi mayor axis of each transfer (negative for hyperbolic transfers),
+            NaN where there is no solution (too short time for M revolutions)
+            or the iteration did not converge
+        iterations: int array:
+            number of iterations of each element
+    """
+    x, lam, s, c, iterations = _lambert_batch(r1, r2, theta, t, M, branch, tol, maxiter, x0)
+    with np.errstate(divide='ignore'):
+        a = s/(2*(1 - x**2))
+    return a, iterations
+
+
+def _lambert_batch(r1, r2, theta, t, M, branch, tol, maxiter, x0):
+    #Householder iterations of LambertBatch, returns Izzo's x (NaN where there is
+    #no solution), lambda, s, c and the number of iterations
+    r1, r2, theta, t, M = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (r1, r2, theta, t, M)))
+    right = np.broadcast_to(np.asarray(branch) == "right" if isinstance(branch, str) else np.asarray(branch, dtype=bool), r1.shape)
+
+    c = np.sqrt(r1**2 + r2**2 - 2*r1*r2*np.cos(theta))
+    s = (r1 + r2 + c)/2
+    lam = np.sqrt(np.clip(1 - c/s, 0, 1))
+    lam = np.where(np.mod(theta, 2*np.pi) > np.pi, -lam, lam)
+    T = np.sqrt(2/s**3)*t
+
+    #Initial guess (Izzo 2015, section 3.1)
+    T0 = np.arccos(lam) + lam*np.sqrt(1 - lam**2)
+    T1 = 2/3*(1 - lam**3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_guess = np.where(T >= T0, -(T - T0)/(T - T0 + 4),
+                           np.where(T < T1, 2.5*T1*(T1 - T)/(T*(1 - lam**5)) + 1,
+                                    (T/T0)**(np.log(2)/np.log(T1/T0)) - 1))
+        left = ((M*np.pi + np.pi)/(8*T))**(2/3)
+        right_ = ((8*T)/(M*np.pi))**(2/3)
+        x0_multi = np.where(right, (right_ - 1)/(right_ + 1), (left - 1)/(left + 1))
+    x = np.where(M > 0, x0_multi, x_guess)
+
+    #M revolution transfers exist only above the minimum time of flight T(x_min),
+    #with dT(x_min) = 0 found by Halley iterations
+    x_min = np.zeros(x.shape)
+    multi = np.flatnonzero(M > 0)
+    if multi.size:
+        lam_m, M_m = lam.ravel()[multi], M.ravel()[multi]
+        xm = np.zeros(multi.size)
+        for _ in range(12):
+            _, dT, ddT, dddT = _lambert_tof(xm, lam_m, M_m)
+            xm = xm - 2*dT*ddT/(2*ddT**2 - dT*dddT)
+        x_min.ravel()[multi] = xm
+
+    if multi.size:
+        T_min = _lambert_tof(x_min.ravel()[multi], lam_m, M_m)[0]
+        x.ravel()[multi[T.ravel()[multi] < T_min]] = np.nan
+
+    #Warm start, multi revolution guesses must lie on the requested branch
+    x_cold = x
+    warm = np.zeros(x.shape, dtype=bool)
+    if x0 is not None:
+        x0 = np.broadcast_to(np.asarray(x0, dtype=float), x.shape)
+        warm = np.isfinite(x0) & np.isfinite(x) & (np.abs(x0) < np.where(M > 0, 1, np.inf))
+        warm &= (M == 0) | (right == (x0 > x_min))
+        x = np.where(warm, x0, x)
+
+    x, iterations, converged = _householder(x, T, lam, M, tol, maxiter)
+    #Warm starts far from the solution are repeated from the default guess
+    retry = np.flatnonzero(warm & ~converged)
+    if retry.size:
+        xr, ir, cr = _householder(x_cold.ravel()[retry], T.ravel()[retry], lam.ravel()[retry],
+                                  M.ravel()[retry], tol, maxiter)
+        x.ravel()[retry], converged.ravel()[retry] = xr, cr
+        iterations.ravel()[retry] += ir
+
+    #Multi revolution solutions must keep the time of flight
+    x = np.where(converged & ((M == 0) | (np.abs(x) < 1)), x, np.nan)
+    return x, lam, s, c, iterations
@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from LambertProblemTools import _lambert_batch
+
+#Result arrays: name -> (dtype, initial value)
+FIELDS = {
+    'a': (np.float64, np.nan),
+    'iterations': (np.int16, -1),
+}
+#Only when the velocities of the bodies are given
+DV_FIELDS = {
+    'dv_dep': (np.float64, np.nan),
+    'dv_arr': (np.float64, np.nan),
+}
+
+
+def _geometry(r):
+    #Norms and unit vectors of positions (n, 2 or 3), computed once per epoch
+    r = np.asarray(r, dtype=float)
+    if r.shape[1] == 2:
+        r = np.column_stack([r, np.zeros(len(r))])
+    norm = np.linalg.norm(r, axis=1)
+    return norm, r/norm[:, None]
+
+
+def _velocities(x, lam, s, c, R1, R2, ir1, ir2, theta, mu):
+    """
+    Velocities of the transfer orbits at departure and arrival (Izzo 2015), arrays (n, m, 3)
+    """
+    y = np.sqrt(1 - lam**2*(1 - x**2))
+    gamma = np.sqrt(mu*s/2)
+    rho = (R1 - R2)/c
+    sigma = np.sqrt(1 - rho**2)
+    vr1 = gamma*((lam*y - x) - rho*(lam*y + x))/R1
+    vr2 = -gamma*((lam*y - x) + rho*(lam*y + x))/R2
+    vt1 = gamma*sigma*(y + lam*x)/R1
+    vt2 = gamma*sigma*(y + lam*x)/R2
+
+    #Prograde normal of the transfer plane
+    ih = np.cross(ir1[:, None, :], ir2[None, :, :])
+    with np.errstate(invalid='ignore'):
+        ih /= np.linalg.norm(ih, axis=-1)[..., None]
+    ih *= np.where(theta > np.pi, -1, 1)[..., None]
+    it1 = np.cross(ih, ir1[:, None, :])
+    it2 = np.cross(ih, ir2[None, :, :])
+
+    v1 = vr1[..., None]*ir1[:, None, :] + vt1[..., None]*it1
+    v2 = vr2[..., None]*ir2[None, :, :] + vt2[..., None]*it2
+    return v1, v2
+
+
+def _run_tile(rows, t_dep, dep, v_dep, paths, t_arr, arr, v_arr, mu, M, branch, warm_start, tol, maxiter):
+    """
+    Solve the rows (departures) of one tile and write them into the .npy files in paths,
+    t_dep, dep and v_dep hold only the departures of the tile
+    """
+    R1, ir1 = dep
+    R2, ir2 = arr
+
+    #Transfer angle measured prograde around +z, in [0, 2pi)
+    cos_theta = np.clip(ir1 @ ir2.T, -1, 1)
+    cross_z = ir1[:, 0, None]*ir2[None, :, 1] - ir1[:, 1, None]*ir2[None, :, 0]
+    theta = np.arccos(cos_theta)
+    theta = np.where(cross_z < 0, 2*np.pi - theta, theta)
+    tof = t_arr[None, :] - t_dep[:, None]
+    #Non dimensional time (GM = 1 in LambertBatch)
+    tau = np.where(tof > 0, tof*np.sqrt(mu), np.nan)
+
+    #Two passes: even rows from Izzo's initial guess, then odd rows warm started
+    #from the converged x of the previous departure epoch
+    passes = [slice(0, None, 2), slice(1, None, 2)] if warm_start else [slice(None)]
+    x = np.full(theta.shape, np.nan)
+    lam, s, c = np.empty((3,) + theta.shape)
+    iterations = np.empty(theta.shape, dtype=int)
+    for n, rows_pass in enumerate(passes):
+        x0 = x[:-1:2][:len(tau[rows_pass])] if n else None
+        x[rows_pass], lam[rows_pass], s[rows_pass], c[rows_pass], iterations[rows_pass] = _lambert_batch(
+            R1[rows_pass, None], R2, theta[rows_pass], tau[rows_pass], M, branch, tol, maxiter, x0)
+
+    files = {field: np.load(path, mmap_mode='r+') for field, path in paths.items()}
+    with np.errstate(divide='ignore'):
+        files['a'][rows] = s/(2*(1 - x**2))
+    files['iterations'][rows] = np.where(np.isfinite(tau), iterations, -1)
+    if v_dep is not None:
+        v1, v2 = _velocities(x, lam, s, c, R1[:, None], R2[None, :], ir1, ir2, theta, mu)
+        files['dv_dep'][rows] = np.linalg.norm(v1 - v_dep[:, None, :], axis=-1)
+        files['dv_arr'][rows] = np.linalg.norm(v_arr[None, :, :] - v2, axis=-1)
+    for f in files.values():
+        f.flush()
+    del files
+    return rows
+
+
+def porkchop(t_dep, r_dep, t_arr, r_arr, v_dep=None, v_arr=None, mu=1, M=0, branch="left",
+             output=None, tile=64, processes=None, warm_start=True, tol=1e-12, maxiter=35):
+    """
+    Porkchop grid (departure epoch x arrival epoch) of Lambert transfers solved with LambertBatch
+
+    The geometry of every epoch (norms and unit vectors) is computed once; the
+    transfer angles of a tile come from a single matrix product. Tiles of
+    departure rows are solved in parallel and written directly into
+    memory mapped .npy files, so only one tile per process is held in memory.
+    Inside a tile every other departure row is warm started from the
+    converged solution of the previous row.
+
+    Parameters:
+        t_dep: array (n):
+            departure epochs
+        r_dep: array (n, 2 or 3):
+            positions of the departure body at t_dep
+        t_arr: array (m):
+            arrival epochs
+        r_arr: array (m, 2 or 3):
+            positions of the arrival body at t_arr
+        v_dep, v_arr: array (n, 2 or 3), (m, 2 or 3) or None:
+            velocities of the bodies, if given the departure and arrival
+            velocity changes dv_dep and dv_arr are also computed
+        mu: float (1):
+            gravitational parameter of the central body (GM = 1 by default,
+            as in LambertProblem)
+        M, branch, tol, maxiter:
+            as in LambertBatch
+        output: str or None:
+            directory where the .npy files are written, by default a
+            temporary directory that is removed after loading the results
+        tile: int (64):
+            number of departure epochs in a tile
+        processes: int or None:
+            number of worker processes (default os.cpu_count()), 1 runs in this process
+        warm_start: bool (True):
+            start odd rows from the solution of the previous departure epoch
+
+
+    Return:
+        results: dict:
+            arrays of shape (n, m) 'a' (semi mayor axis of the transfer, NaN where
+            there is no solution or the time of flight is not positive),
+            'iterations' (-1 where the time of flight is not positive) and, with
+            the velocities, 'dv_dep' and 'dv_arr'. Memory mapped (read only)
+            when output is given.
+    """
+    t_dep = np.asarray(t_dep, dtype=float)
+    t_arr = np.asarray(t_arr, dtype=float)
+    dep, arr = _geometry(r_dep), _geometry(r_arr)
+    if len(dep[0]) != len(t_dep) or len(arr[0]) != len(t_arr):
+        raise ValueError('Epochs and positions must have the same length')
+    if (v_dep is None) != (v_arr is None):
+        raise ValueError('Give both v_dep and v_arr or none of them')
+    if v_dep is not None:
+        v_dep = np.asarray(v_dep, dtype=float)
+        v_arr = np.asarray(v_arr, dtype=float)
+        v_dep = np.column_stack([v_dep, np.zeros(len(v_dep))]) if v_dep.shape[1] == 2 else v_dep
+        v_arr = np.column_stack([v_arr, np.zeros(len(v_arr))]) if v_arr.shape[1] == 2 else v_arr
+
+    directory = output or tempfile.mkdtemp(prefix='porkchop')
+    os.makedirs(directory, exist_ok=True)
+    fields = dict(FIELDS, **(DV_FIELDS if v_dep is not None else {}))
+    paths = {}
+    for field, (dtype, fill) in fields.items():
+        paths[field] = os.path.join(directory, f'{field}.npy')
+        f = np.lib.format.open_memmap(paths[field], mode='w+', dtype=dtype,
+                                      shape=(len(t_dep), len(t_arr)))
+        f[:] = fill
+        f.flush()
+        del f
+
+    args = (paths, t_arr, arr, v_arr, mu, M, branch, warm_start, tol, maxiter)
+    tiles = [np.arange(i, min(i+tile, len(t_dep))) for i in range(0, len(t_dep), tile)]
+    #Departure epochs, geometry and velocities of every tile
+    departures = [(t_dep[rows], (dep[0][rows], dep[1][rows]), None if v_dep is None else v_dep[rows])
+                  for rows in tiles]
+    try:
+        if processes == 1:
+            for rows, departure in zip(tiles, departures):
+                _run_tile(rows, *departure, *args)
+        else:
+            with ProcessPoolExecutor(processes) as pool:
+                list(pool.map(_run_tile, tiles, *zip(*departures),
+                              *[[arg]*len(tiles) for arg in args]))
+
+        if output:
+            return {field: np.load(path, mmap_mode='r') for field, path in paths.items()}
+        return {field: np.load(path) for field, path in paths.items()}
+    finally:
+        if not output:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -1,20 +1,149 @@
+import pickle
+from collections import OrderedDict
+
 import numpy as np
 from scipy.integrate import quad
 
-def blap(a, s, j):
+class LaplaceCache():
+    """
+    LRU cache of Laplace coefficients keyed on (alpha, s, j)
+
+    Parameters:
+        maxsize: int (1):
+            maximum number of stored coefficients, the least recently used
+            ones are evicted first
+        tol: float (1) or None:
+            if given alpha is rounded to a multiple of tol and the coefficient
+            is computed at the rounded alpha, so values of alpha closer than
+            tol share the same coefficient whatever the order of the calls
+    """
+    def __init__(self, maxsize=4096, tol=None):
+        self.maxsize = maxsize
+        self.tol = tol
+        self.data = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def key(self, a, s, j):
+        a = float(a) if self.tol is None else round(a/self.tol)*self.tol
+        return (a, float(s), float(j))
+
+    def get(self, a, s, j, function):
+        key = self.key(a, s, j)
+        if key in self.data:
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+
+        self.misses += 1
+        #Computed at the alpha of the key (rounded with tol)
+        value = function(key[0], s, j)
+        self.data[key] = value
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    size=len(self.data), maxsize=self.maxsize, tol=self.tol)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def save(self, path):
+        #Stored coefficients are kept between sessions with load
+        with open(path, 'wb') as f:
+            pickle.dump(dict(tol=self.tol, data=list(self.data.items())), f)
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved['tol'] != self.tol:
+            raise ValueError(f'Cache in {path} was built with tol = {saved["tol"]}')
+        for key, value in saved['data']:
+            self.data[key] = value
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+#Cache shared by blap, blap_dot and blap_ddot
+cache = LaplaceCache()
+
+def configure_cache(maxsize=4096, tol=None):
+    #Replace the shared cache (stored coefficients are dropped)
+    global cache
+    cache = LaplaceCache(maxsize, tol)
+    return cache
+
+def _blap_quad(a, s, j):
     #Integrand in b_s^j definition
     func = lambda x: np.cos(j*x)/(1-2*a*np.cos(x)+a**2)**s
-    
+
     return (1/np.pi)*quad(func, 0, 2*np.pi)[0]
 
+def blap(a, s, j):
+    #Laplace coefficient b_s^j(a), memoized in cache
+    return cache.get(a, s, j, _blap_quad)
+
 def blap_dot(a, s, j):
     #Recursive first derivative
-    dot = blap(a, s+1, j-1) - 2*a*blap(a, s+1, j) + blap(a, s+1, j+1) 
-    
+    dot = blap(a, s+1, j-1) - 2*a*blap(a, s+1, j) + blap(a, s+1, j+1)
+
     return s*dot
 
 def blap_ddot(a, s, j):
     #Recursive second derivative
     ddot = blap_dot(a, s+1, j-1) - 2*a*blap_dot(a, s+1, j) + blap_dot(a, s+1, j+1) - 2*blap(a, s+1, j)
-    
+
     return s*ddot
+
+def _blap_fft(a, s, jmax, order=0):
+    #Trapezoid rule on the periodic integrand (spectrally accurate) for all j <= jmax
+    #at once: the cosine coefficients of the integrand are given by a real FFT.
+    #The error decays as a^n, so each a gets the smallest power of two n with
+    #a^(n-jmax) ~ 1e-17; values of a sharing n are evaluated together.
+    #order = 0, 1, 2 gives b_s^j, D b_s^j and D^2 b_s^j
+    n_min = 2*jmax + 2
+    n_a = jmax - 40/np.log(np.clip(a, 1e-3, 0.999))
+    n_a = 2**np.ceil(np.log2(np.maximum(n_a, n_min))).astype(int)
+
+    out = np.empty((len(a), jmax + 1))
+    for n in np.unique(n_a):
+        x = 2*np.pi*np.arange(n)/n
+        group = np.nonzero(n_a == n)[0]
+        chunk = max(1, 2**22//n)
+        for i in range(0, len(group), chunk):
+            rows = group[i:i+chunk]
+            ac = a[rows, None]
+            delta = 1 - 2*ac*np.cos(x) + ac**2
+            if order == 0:
+                func = delta**(-s)
+            elif order == 1:
+                func = -2*s*(ac - np.cos(x))*delta**(-s-1)
+            else:
+                func = -2*s*delta**(-s-1) + 4*s*(s+1)*(ac - np.cos(x))**2*delta**(-s-2)
+            out[rows] = (2/n)*np.fft.rfft(func, axis=1).real[:, :jmax+1]
+    return out
+
+def _blap_array(a, s, j, order):
+    a, j = np.broadcast_arrays(np.asarray(a, dtype=float), np.abs(np.asarray(j, dtype=int)))
+    if a.size == 0:
+        return np.zeros(a.shape)
+    au, inverse = np.unique(a, return_inverse=True)
+    coefficients = _blap_fft(au, s, int(j.max()), order)
+    return coefficients[inverse.reshape(a.shape), j]
+
+def blap_array(a, s, j):
+    #Laplace coefficients b_s^j(a) for arrays of a and j (broadcast together)
+    return _blap_array(a, s, j, 0)
+
+def blap_dot_array(a, s, j):
+    #First derivative from the derivative of the integrand, no recursion
+    return _blap_array(a, s, j, 1)
+
+def blap_ddot_array(a, s, j):
+    #Second derivative from the second derivative of the integrand
+    return _blap_array(a, s, j, 2)
+
+from .laplace_lagrange import LaplaceLagrange
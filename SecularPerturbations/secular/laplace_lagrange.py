@@ -0,0 +1,118 @@
+import numpy as np
+
+from . import blap_array
+
+def _alphas(a_in, a_out):
+    #alpha_jk and the product alpha_jk*alphabar_jk for bodies with semi major axes a_in
+    #perturbed by bodies with semi major axes a_out (Murray & Dermott 7.2)
+    inner = a_in[:, None] < a_out[None, :]
+    alpha = np.where(inner, a_in[:, None]/a_out[None, :], a_out[None, :]/a_in[:, None])
+    alpha_prod = np.where(inner, alpha**2, alpha)
+    return alpha, alpha_prod
+
+class LaplaceLagrange():
+    """
+    Laplace-Lagrange secular theory for N planets (Murray & Dermott chapter 7)
+
+    Parameters:
+        m: array (N):
+            masses of the planets in units of the central mass
+        a: array (N):
+            semi mayor axes [AU]
+        n: array (N) or None:
+            mean motions [rad/yr], by default 2*pi*sqrt((1+m)/a^3)
+
+    The secular matrices A (eccentricities) and B (inclinations) are built
+    with the vectorized Laplace coefficients of blap_array and diagonalized
+    once. After solve(e, varpi, I, Omega) the elements can be evaluated at
+    any array of times in one broadcast operation.
+    """
+    def __init__(self, m, a, n=None):
+        self.m = np.atleast_1d(np.asarray(m, dtype=float))
+        self.a = np.atleast_1d(np.asarray(a, dtype=float))
+        self.n = 2*np.pi*np.sqrt((1 + self.m)/self.a**3) if n is None else np.atleast_1d(np.asarray(n, dtype=float))
+        N = len(self.a)
+
+        alpha, alpha_prod = _alphas(self.a, self.a)
+        others = ~np.eye(N, dtype=bool)
+        factor = np.where(others, 0.25*self.n[:, None]*self.m[None, :]/(1 + self.m[:, None])*alpha_prod, 0)
+        b1 = np.where(others, blap_array(np.where(others, alpha, 0), 1.5, 1), 0)
+        b2 = np.where(others, blap_array(np.where(others, alpha, 0), 1.5, 2), 0)
+
+        #Secular matrices (Murray & Dermott 7.9-7.12)
+        self.A = -factor*b2 + np.diag((factor*b1).sum(axis=1))
+        self.B = factor*b1 - np.diag((factor*b1).sum(axis=1))
+
+        #Eigenfrequencies g_i, f_i [rad/yr] and normalized eigenvectors
+        self.g, self.eigen_A = np.linalg.eig(self.A)
+        self.f, self.eigen_B = np.linalg.eig(self.B)
+        self.g, self.eigen_A = self.g.real, self.eigen_A.real
+        self.f, self.eigen_B = self.f.real, self.eigen_B.real
+
+    def solve(self, e, varpi, I, Omega):
+        #Scaled eigenvectors e_ji, I_ji and phases beta_i, gamma_i from the initial elements
+        e, varpi, I, Omega = np.broadcast_arrays(e, varpi, I, Omega)
+        h0, k0 = e*np.sin(varpi), e*np.cos(varpi)
+        p0, q0 = I*np.sin(Omega), I*np.cos(Omega)
+
+        x, y = np.linalg.solve(self.eigen_A, np.array([h0, k0]).T).T
+        self.S, self.beta = np.sqrt(x**2 + y**2), np.arctan2(x, y)
+        self.eij = self.eigen_A*self.S
+
+        x, y = np.linalg.solve(self.eigen_B, np.array([p0, q0]).T).T
+        self.T, self.gamma = np.sqrt(x**2 + y**2), np.arctan2(x, y)
+        self.Iij = self.eigen_B*self.T
+        return self
+
+    def hkpq(self, t):
+        #h, k, p, q of every planet, arrays of shape (N, len(t))
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        phase_e = np.outer(self.g, t) + self.beta[:, None]
+        phase_I = np.outer(self.f, t) + self.gamma[:, None]
+        h = self.eij @ np.sin(phase_e)
+        k = self.eij @ np.cos(phase_e)
+        p = self.Iij @ np.sin(phase_I)
+        q = self.Iij @ np.cos(phase_I)
+        return h, k, p, q
+
+    def elements(self, t):
+        #e, varpi, I, Omega of every planet, arrays of shape (N, len(t))
+        h, k, p, q = self.hkpq(t)
+        return np.hypot(h, k), np.mod(np.arctan2(h, k), 2*np.pi), np.hypot(p, q), np.mod(np.arctan2(p, q), 2*np.pi)
+
+    def test_particle(self, a, n=None):
+        #Proper frequencies A, B (M,) and coefficients A_j, B_j (M, N) of test particles
+        #with semi mayor axes a (Murray & Dermott 7.55-7.58)
+        a = np.atleast_1d(np.asarray(a, dtype=float))
+        n = 2*np.pi/a**1.5 if n is None else np.broadcast_to(n, a.shape)
+
+        alpha, alpha_prod = _alphas(a, self.a)
+        factor = 0.25*n[:, None]*self.m[None, :]*alpha_prod
+        A_j = -factor*blap_array(alpha, 1.5, 2)
+        B_j = factor*blap_array(alpha, 1.5, 1)
+        A = B_j.sum(axis=1)
+        return A, -A, A_j, B_j
+
+    def forced(self, a, t, n=None):
+        #Forced h, k, p, q of test particles with semi mayor axes a, arrays of shape (M, len(t))
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        A, B, A_j, B_j = self.test_particle(a, n)
+        nu = A_j @ self.eij
+        mu = B_j @ self.Iij
+
+        phase_e = np.outer(self.g, t) + self.beta[:, None]
+        phase_I = np.outer(self.f, t) + self.gamma[:, None]
+        #Amplitudes diverge at secular resonances (A = g_i or B = f_i)
+        with np.errstate(divide='ignore'):
+            amplitude_e = -nu/(A[:, None] - self.g[None, :])
+            amplitude_I = -mu/(B[:, None] - self.f[None, :])
+        h = amplitude_e @ np.sin(phase_e)
+        k = amplitude_e @ np.cos(phase_e)
+        p = amplitude_I @ np.sin(phase_I)
+        q = amplitude_I @ np.cos(phase_I)
+        return h, k, p, q
+
+    def forced_elements(self, a, t, n=None):
+        #Forced eccentricity and inclination of test particles, arrays of shape (M, len(t))
+        h, k, p, q = self.forced(a, t, n)
+        return np.hypot(h, k), np.hypot(p, q)
@@ -0,0 +1,91 @@
+import time
+
+import numpy as np
+from scipy.optimize import fsolve
+
+from kepler import KeplerTable, kepler
+
+
+def timer(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def newton_danby(M, e, E0, abstol=1e-5):
+    # Scalar routine of Chapter2-TheTwoBodyProblem.ipynb
+    Ei = 2*E0
+    one_sixth = 1/6
+    i = 0
+    while abs(Ei-E0) > abstol:
+        e_sinEi = e*np.sin(Ei)
+        e_cosEi = e*np.cos(Ei)
+        fi = Ei-e_sinEi-M
+        fpi = 1-e_cosEi
+        fppi = e_sinEi
+        delta1i = -fi/fpi
+        delta2i = -fi/(fpi + 0.5*delta1i*fppi)
+        delta3i = -fi/(fpi + 0.5*delta2i*fppi + one_sixth*delta2i**2*fppi)
+        E0 = Ei
+        Ei = Ei + delta3i
+        i += 1
+    return Ei, abs(Ei-E0), i
+
+
+def ksolve(ma, e):
+    # Scalar routine of PlanetaryRings/Chapter_10.ipynb
+    def f(ea, ma):
+        return ea - e*np.sin(ea) - ma
+    ea_guess = ma
+    ea_sol = fsolve(f, ea_guess, args=(ma,))
+    return ea_sol[0]
+
+
+def kepler_residual(E, M, e):
+    return np.max(np.abs(E - e*np.sin(E) - M))
+
+
+def bench_kepler(n=1000000, n_scalar=20000, e=0.3, seed=0):
+    """Throughput of kepler and KeplerTable against the notebook routines"""
+    rng = np.random.default_rng(seed)
+    M = rng.uniform(0, 2*np.pi, n)
+    es = rng.uniform(0, 0.99, n)
+    Ms = M[:n_scalar]
+
+    def loop_danby():
+        return np.array([newton_danby(m, e, m + 0.85*e*np.sign(np.sin(m)), abstol=1e-14)[0]
+                         for m in Ms])
+
+    def loop_fsolve():
+        return np.array([ksolve(m, e) for m in Ms])
+
+    print(f"Kepler equation (e = {e}, scalar routines on {n_scalar} values)")
+    rows = []
+    for label, function, size in [("newton_danby loop", loop_danby, n_scalar),
+                                  ("ksolve (fsolve) loop", loop_fsolve, n_scalar)]:
+        elapsed, E = timer(function)
+        rows.append((label, size/elapsed, kepler_residual(E, Ms, e)))
+
+    elapsed, E = timer(kepler, M, e)
+    rows.append(("kepler (masks)", n/elapsed, kepler_residual(E, M, e)))
+    elapsed, E = timer(kepler, M, e, niter=3)
+    rows.append(("kepler (niter=3)", n/elapsed, kepler_residual(E, M, e)))
+    table = KeplerTable(e)
+    elapsed, E = timer(table, M)
+    rows.append(("KeplerTable", n/elapsed, kepler_residual(E, M, e)))
+    elapsed, E = timer(kepler, M, es)
+    rows.append(("kepler (e in [0,0.99])", n/elapsed, kepler_residual(E, M, es)))
+
+    for label, rate, residual in rows:
+        print(f"  {label:24s}: {rate:12.0f} solutions/s  residual {residual:.1e}")
+
+    F = np.linspace(-20, 20, n)
+    eh = rng.uniform(1.01, 10, n)
+    Mh = eh*np.sinh(F) - F
+    elapsed, Fs = timer(kepler, Mh, eh)
+    print(f"  {'kepler (hyperbolic)':24s}: {n/elapsed:12.0f} solutions/s"
+          f"  max rel. error {np.max(np.abs(Fs - F)/np.maximum(1, np.abs(F))):.1e}")
+
+
+if __name__ == "__main__":
+    bench_kepler()
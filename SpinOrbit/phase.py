@@ -0,0 +1,176 @@
+"""
+Orbital phase tables for the spin-orbit equations.
+
+The torque on the satellite depends on the orbit only through a/r and the
+true anomaly f at the mean anomaly M = n t. A PhaseTable solves Kepler's
+equation once on n + 1 equally spaced mean anomalies of one period and
+serves r/a, f and df/dM at any M by periodic cubic Hermite interpolation
+(the derivatives are known in closed form). The interpolation error is
+bounded by h^4/384 max|y''''|, estimated from the fourth differences of the
+table; the estimate holds once the table resolves the pericenter passage
+(a few hundred nodes are not enough for e = 0.9). get_table keeps the
+tables in an LRU cache keyed by (e, resolution) with a memory budget, so
+sweeps over eccentricities reuse them. Kepler's equation is solved by the
+vectorized solver of Special2B/kepler.py.
+"""
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'Special2B'))
+from kepler import kepler, eccentric_to_true
+
+
+def orbit_phase(M, e):
+    """a/r, true anomaly f and df/dM at the mean anomalies M (solving Kepler's equation)"""
+    E = kepler(M, e)
+    f = eccentric_to_true(E, e)
+    a_r = 1/(1 - e*np.cos(E))
+    return a_r, f, np.sqrt(1 - e**2)*a_r**2
+
+
+class PhaseTable():
+    """r/a and f over one orbital period for a fixed eccentricity
+
+    Args:
+        e (float): eccentricity, 0 <= e < 1
+        resolution (int): number of intervals of the table in [0, 2pi]
+
+    Attributes:
+        M (array): nodes 2 pi k/resolution, k = 0..resolution
+        a_r, f, f_dot (array): a/r, f (continuous, from 0 to 2pi) and df/dM at the nodes
+        error (dict): bound of the interpolation error of 'r' (r/a) and 'f'
+    """
+    def __init__(self, e, resolution=1024):
+        if not 0 <= e < 1:
+            raise ValueError(f'PhaseTable needs an elliptic orbit, e = {e}')
+        self.e = float(e)
+        self.resolution = int(resolution)
+        self.h = 2*np.pi/self.resolution
+        self.M = np.linspace(0, 2*np.pi, self.resolution + 1)
+        self.a_r, f, self.f_dot = orbit_phase(self.M, self.e)
+        self.f = np.unwrap(f)
+        self.f[-1] = 2*np.pi
+
+        # Periodic quantities and their derivatives in M: r/a and f - M
+        self.r_a = 1/self.a_r
+        self.dr_a = self.e*np.sin(self.f)/np.sqrt(1 - self.e**2)
+        self.g = self.f - self.M
+        self.dg = self.f_dot - 1
+        self.error = {'r': _hermite_bound(self.r_a), 'f': _hermite_bound(self.g)}
+
+    @property
+    def nbytes(self):
+        return sum(v.nbytes for v in (self.M, self.a_r, self.f, self.f_dot, self.r_a,
+                                      self.dr_a, self.g, self.dg))
+
+    def _locate(self, M):
+        M = np.asarray(M, dtype=float)
+        turns = np.floor(M/(2*np.pi))
+        u = (M - 2*np.pi*turns)/self.h
+        i = np.minimum(u.astype(int), self.resolution - 1)
+        return turns, i, u - i
+
+    def _hermite(self, y, dy, i, s):
+        s2, s3 = s*s, s*s*s
+        return ((2*s3 - 3*s2 + 1)*y[i] + (s3 - 2*s2 + s)*self.h*dy[i]
+                + (-2*s3 + 3*s2)*y[i+1] + (s3 - s2)*self.h*dy[i+1])
+
+    def r(self, M):
+        """r/a at the mean anomalies M"""
+        _, i, s = self._locate(M)
+        return self._hermite(self.r_a, self.dr_a, i, s)
+
+    def true_anomaly(self, M):
+        """True anomaly at the mean anomalies M, continuous (f - M is periodic)"""
+        M = np.asarray(M, dtype=float)
+        _, i, s = self._locate(M)
+        return M + self._hermite(self.g, self.dg, i, s)
+
+    def __call__(self, M):
+        """a/r, f and df/dM at the mean anomalies M, as orbit_phase"""
+        M = np.asarray(M, dtype=float)
+        _, i, s = self._locate(M)
+        a_r = 1/self._hermite(self.r_a, self.dr_a, i, s)
+        f = M + self._hermite(self.g, self.dg, i, s)
+        return a_r, f, np.sqrt(1 - self.e**2)*a_r**2
+
+
+def _hermite_bound(y):
+    # h^4/384 max|y''''| with h^4 y'''' from the periodic fourth differences, doubled
+    # as the differences underestimate the peak, plus the rounding error of f = M + g
+    y = y[:-1]
+    d4 = np.roll(y, 2) - 4*np.roll(y, 1) + 6*y - 4*np.roll(y, -1) + np.roll(y, -2)
+    return 2*np.abs(d4).max()/384 + 16*np.pi*np.finfo(float).eps
+
+
+def resolution_for(e, tol=1e-10, resolution=64, max_resolution=2**20):
+    """Smallest power of two resolution with interpolation error bounds below tol"""
+    while resolution < max_resolution:
+        if max(PhaseTable(e, resolution).error.values()) <= tol:
+            break
+        resolution *= 2
+    return resolution
+
+
+class PhaseCache():
+    """
+    LRU cache of PhaseTable keyed on (e, resolution)
+
+    Args:
+        max_bytes (int): memory budget, the least recently used tables are
+            evicted when the tables in the cache use more than max_bytes
+    """
+    def __init__(self, max_bytes=64*2**20):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def key(self, e, resolution):
+        return (float(e), int(resolution))
+
+    def get(self, e, resolution):
+        key = self.key(e, resolution)
+        if key in self.data:
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+
+        self.misses += 1
+        table = PhaseTable(e, resolution)
+        self.data[key] = table
+        while self.nbytes > self.max_bytes and len(self.data) > 1:
+            self.data.popitem(last=False)
+            self.evictions += 1
+        return table
+
+    @property
+    def nbytes(self):
+        return sum(table.nbytes for table in self.data.values())
+
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    size=len(self.data), nbytes=self.nbytes, max_bytes=self.max_bytes)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+# Cache shared by get_table and spinorbit
+cache = PhaseCache()
+
+
+def configure_cache(max_bytes=64*2**20):
+    """Replace the shared cache (stored tables are dropped)"""
+    global cache
+    cache = PhaseCache(max_bytes)
+    return cache
+
+
+def get_table(e, resolution=1024):
+    """PhaseTable from the shared cache, computed on the first request"""
+    return cache.get(e, resolution)
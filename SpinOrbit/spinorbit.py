@@ -0,0 +1,244 @@
+"""
+Vectorized spin-orbit integrator.
+
+The spin of a satellite with moments of inertia A < B < C on a Keplerian
+orbit follows (Murray & Dermott 5.56), in units where n = 1 and t = M:
+
+    theta'' + (omega0^2/2) (a/r)^3 sin 2(theta - f) = tidal torque
+
+with omega0^2 = 3 (B - A)/C. Batches of (theta, theta') initial conditions
+are integrated together with a fixed step RK4. Every stage of the scheme
+falls on the same orbital phases each orbit, the nodes of a cached
+phase.PhaseTable, so Kepler's equation is never solved in the loop.
+Surfaces of section are sampled at pericenter passages, and capture maps
+count the fraction of despinning orbits trapped in the 1:1, 3:2 and 5:2
+resonances over a process pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import brentq
+
+from phase import get_table
+
+# Resonances p of the capture maps (theta' = p n)
+RESONANCES = (1, 1.5, 2.5)
+
+# H(p, e) of Murray & Dermott Table 5.1 as {p: ((power of e, coefficient), ...)}
+H_COEFFICIENTS = {
+    0.5: ((1, -1/2), (3, 1/16)),
+    1: ((0, 1), (2, -5/2), (4, 13/16)),
+    1.5: ((1, 7/2), (3, -123/16)),
+    2: ((2, 17/2), (4, -115/6)),
+    2.5: ((3, 845/48),),
+    3: ((4, 533/16),),
+}
+
+
+def H(p, e):
+    """Strength H(p, e) of the p resonance (Murray & Dermott Table 5.1)"""
+    e = np.asarray(e, dtype=float)
+    return sum(c*e**k for k, c in H_COEFFICIENTS[p])
+
+
+def libration_width(p, e, omega0):
+    """Half width in theta'/n of the p resonance, omega0 sqrt|H(p, e)|"""
+    return omega0*np.sqrt(np.abs(H(p, e)))
+
+
+def _stage_phase(e, steps):
+    # (a/r)^3, (a/r)^6, f and df/dM at the 2 steps + 1 half steps of an orbit,
+    # the nodes of the phase table of resolution 2 steps
+    table = get_table(e, 2*steps)
+    return table.a_r**3, table.a_r**6, table.f, table.f_dot
+
+
+def _acceleration(theta, dtheta, phase, omega0, K, tides):
+    a_r3, a_r6, f, f_dot = phase
+    acc = -0.5*omega0**2*a_r3*np.sin(2*(theta - f))
+    if K:
+        if tides == 'constant':
+            acc -= K*a_r6*np.sign(dtheta - f_dot)
+        elif tides == 'linear':
+            acc -= K*a_r6*(dtheta - f_dot)
+        else:
+            raise ValueError(f'Not valid tides {tides}')
+    return acc
+
+
+def equation(y, t, e, omega0, K=0, tides='constant', resolution=1024):
+    """Right hand side [theta', theta''] for odeint (t = M), with a/r and f
+    interpolated from the phase table of (e, resolution)"""
+    theta, dtheta = y
+    phase = get_table(e, resolution)(t)
+    phase = (phase[0]**3, phase[0]**6, phase[1], phase[2])
+    return [dtheta, _acceleration(theta, dtheta, phase, omega0, K, tides)]
+
+
+def tidal_torque(spin, e, tides='constant', steps=128):
+    """Orbit averaged tidal torque per unit K at a spin rate in units of n (positive despins)"""
+    a_r3, a_r6, f, f_dot = (q[:-1] for q in _stage_phase(float(e), steps))
+    if tides == 'constant':
+        return np.mean(a_r6*np.sign(spin - f_dot))
+    if tides == 'linear':
+        return np.mean(a_r6*(spin - f_dot))
+    raise ValueError(f'Not valid tides {tides}')
+
+
+def equilibrium_spin(e, tides='constant', steps=128):
+    """Spin rate in units of n where the orbit averaged tidal torque vanishes"""
+    f_dot = _stage_phase(float(e), steps)[3]
+    return brentq(tidal_torque, f_dot.min() - 1e-9, f_dot.max() + 1e-9, args=(e, tides, steps))
+
+
+def integrate(theta0, dtheta0, e, omega0, orbits, K=0, tides='constant', steps=128,
+              samples_per_orbit=1):
+    """Spin of a batch of initial conditions
+
+    Args:
+        theta0 (array): Initial angles of the long axis from the pericenter line
+        dtheta0 (array): Initial spin rates in units of n, broadcast against theta0
+        e (float): Eccentricity of the orbit
+        omega0 (float): sqrt(3(B-A)/C)
+        orbits (int): Number of orbital periods, starting at pericenter
+        K (float): Tidal despinning rate in units of n^2 (0 without tides)
+        tides (str): "constant" (1/Q constant, torque ~ -K (a/r)^6 sign(theta'-f'))
+            or "linear" (1/Q ~ frequency, torque ~ -K (a/r)^6 (theta'-f'))
+        steps (int): RK4 steps per orbit
+        samples_per_orbit (int): outputs per orbit, must divide steps
+
+    Returns:
+        t: array (orbits*samples_per_orbit+1,) of times (mean anomalies)
+        theta, dtheta: arrays (len(t),) + shape of the initial conditions
+    """
+    if steps % samples_per_orbit:
+        raise ValueError('samples_per_orbit must divide steps')
+    theta, dtheta = (np.array(v, dtype=float) for v in np.broadcast_arrays(theta0, dtheta0))
+    table = _stage_phase(float(e), steps)
+    h = 2*np.pi/steps
+    every = steps//samples_per_orbit
+
+    n_samples = orbits*samples_per_orbit + 1
+    thetas = np.empty((n_samples,) + theta.shape)
+    dthetas = np.empty((n_samples,) + theta.shape)
+    thetas[0], dthetas[0] = theta, dtheta
+    for k in range(orbits*steps):
+        i = 2*(k % steps)
+        p0, p1, p2 = ([q[i + j] for q in table] for j in range(3))
+        k1 = _acceleration(theta, dtheta, p0, omega0, K, tides)
+        k2 = _acceleration(theta + 0.5*h*dtheta, dtheta + 0.5*h*k1, p1, omega0, K, tides)
+        k3 = _acceleration(theta + 0.5*h*dtheta + 0.25*h**2*k1, dtheta + 0.5*h*k2, p1, omega0, K, tides)
+        k4 = _acceleration(theta + h*dtheta + 0.5*h**2*k2, dtheta + h*k3, p2, omega0, K, tides)
+        theta = theta + h*dtheta + h**2*(k1 + k2 + k3)/6
+        dtheta = dtheta + h*(k1 + 2*k2 + 2*k3 + k4)/6
+        if (k + 1) % every == 0:
+            thetas[(k + 1)//every] = theta
+            dthetas[(k + 1)//every] = dtheta
+    t = np.linspace(0, 2*np.pi*orbits, n_samples)
+    return t, thetas, dthetas
+
+
+def surface_of_section(e, omega0, theta0, dtheta0, orbits=200, steps=128):
+    """Spin-orbit surface of section (Murray & Dermott 5.7)
+
+    Every initial condition is integrated without tides and sampled at
+    pericenter passages.
+
+    Returns:
+        theta: array (orbits, N), angle at pericenter reduced to [-pi/2, pi/2)
+        dtheta: array (orbits, N), spin rate in units of n
+    """
+    _, theta, dtheta = integrate(np.ravel(theta0), np.ravel(dtheta0), e, omega0, orbits,
+                                 steps=steps)
+    return (theta[1:] + np.pi/2) % np.pi - np.pi/2, dtheta[1:]
+
+
+def plot_section(ax, e, omega0, n_orbits=20, orbits=200, dtheta=(0.5, 3), steps=128, **kwargs):
+    """Surface of section of n_orbits initial spins along theta = 0 on a matplotlib axis"""
+    dtheta0 = np.linspace(*dtheta, n_orbits)
+    theta, dtheta = surface_of_section(e, omega0, np.zeros(n_orbits), dtheta0, orbits, steps)
+    kwargs.setdefault('s', 0.5)
+    kwargs.setdefault('c', 'k')
+    ax.scatter(theta, dtheta, **kwargs)
+    ax.set_xlabel(r'$\theta$')
+    ax.set_ylabel(r'$\dot\theta/n$')
+    ax.set_xlim(-np.pi/2, np.pi/2)
+    return ax
+
+
+def capture(p, e, omega0, K, n_trials=100, tides='constant', margin=3, window=10,
+            max_orbits=20000, steps=128, seed=None):
+    """Fraction of despinning orbits captured in the p resonance
+
+    n_trials orbits start with random angles and spin p + margin widths and
+    are integrated in blocks of at least window orbits, long enough for the
+    tidal torque at p to change the spin by half a width. An orbit is
+    captured when its mean spin over two consecutive blocks is within a
+    quarter width of p. It escapes when its mean spin falls a width below p
+    or halfway to the tidal equilibrium spin, whichever is closer to p, or
+    when it stops despinning away from p and the equilibrium (trapped in
+    another resonance). Orbits undecided after max_orbits count as not
+    captured, and if the tidal equilibrium lies above the resonance 0 is
+    returned without integrating.
+    """
+    width = libration_width(p, e, omega0)
+    equilibrium = equilibrium_spin(e, tides, steps)
+    if equilibrium > p + 0.25*width:
+        return 0.0
+    escape = p - width
+    if equilibrium < p - 0.25*width:
+        escape = max(escape, 0.5*(p + equilibrium))
+    rate = 2*np.pi*K*abs(tidal_torque(p, e, tides, steps))
+    window = int(np.clip(0.5*width/rate if rate else np.inf, window, max(window, max_orbits//100)))
+
+    rng = np.random.default_rng(seed)
+    theta = rng.uniform(0, np.pi, n_trials)
+    dtheta = np.full(n_trials, p + margin*width)
+    settled = np.zeros(n_trials, dtype=int)
+    escaped = np.zeros(n_trials, dtype=bool)
+    previous = dtheta
+    for _ in range(0, max_orbits, window):
+        _, thetas, dthetas = integrate(theta, dtheta, e, omega0, window, K, tides, steps)
+        mean_spin = (thetas[-1] - thetas[0])/(2*np.pi*window)
+        theta, dtheta = thetas[-1], dthetas[-1]
+        settled = np.where(np.abs(mean_spin - p) < 0.25*width, settled + 1, 0)
+        trapped = ((np.abs(mean_spin - previous) < 0.25*width) & (settled == 0)
+                   & (np.abs(mean_spin - equilibrium) > width))
+        escaped |= (mean_spin < escape) | trapped
+        previous = mean_spin
+        if np.all(escaped | (settled >= 2)):
+            break
+    return np.mean((settled >= 2) & ~escaped)
+
+
+def _run_cell(args):
+    p, e, omega0, K, n_trials, tides, margin, window, max_orbits, steps, seed = args
+    return capture(p, e, omega0, K, n_trials, tides, margin, window, max_orbits, steps, seed)
+
+
+def capture_map(e, omega0, K, p=RESONANCES, n_trials=100, tides='constant', margin=3,
+                window=10, max_orbits=20000, steps=128, processes=None, seed=0):
+    """Capture probabilities over a grid of eccentricities and omega0 over a process pool
+
+    Args:
+        e (array): Eccentricities
+        omega0 (array): sqrt(3(B-A)/C) values
+        K (float): Tidal despinning rate in units of n^2
+        p (tuple): Resonances
+        n_trials, tides, margin, window, max_orbits, steps: as in capture
+        processes (int): number of worker processes, 1 runs in this process
+        seed (int): seed of the random initial angles (one stream per cell)
+
+    Returns:
+        probability: array (len(p), len(e), len(omega0))
+    """
+    cells = [(pi, float(ei), float(wi)) for pi in p for ei in np.atleast_1d(e)
+             for wi in np.atleast_1d(omega0)]
+    seeds = np.random.SeedSequence(seed).spawn(len(cells))
+    tasks = [cell + (K, n_trials, tides, margin, window, max_orbits, steps, s) for cell, s in zip(cells, seeds)]
+    if processes == 1:
+        results = list(map(_run_cell, tasks))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_run_cell, tasks))
+    return np.array(results).reshape(len(p), np.size(e), np.size(omega0))
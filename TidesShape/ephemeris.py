@@ -0,0 +1,296 @@
+"""
+Local SPICE kernel and ephemeris manager for the tides and rings notebooks.
+
+Kernels are furnished once per process (furnsh keeps track of what is
+loaded), body constants such as RADII and GM are memoized, and JPL Horizons
+tables (vectors, elements, ephemerides) are stored on disk keyed by
+(kind, body, location, epochs, refplane), so later runs read them without
+network access. Ephemeris.state interpolates cached state vectors over
+arrays of epochs with cubic Hermite polynomials, and with offline=True
+nothing is ever requested from Horizons.
+
+The bundled kernels are the leapseconds and Earth orientation kernels of
+TidesShape and the text PCKs of PlanetaryRings/data. Missing or empty
+kernels are skipped with a warning; body_frame() then falls back from
+ITRF93 to IAU_EARTH. From PlanetaryRings:
+
+    sys.path.append('../TidesShape')
+    import ephemeris
+"""
+import functools
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+import spiceypy as spy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Bundled kernels: name -> path
+KERNELS = {
+    'leapseconds': os.path.join(ROOT, 'TidesShape', 'latest_leapseconds.tls'),
+    'earth_orientation': os.path.join(ROOT, 'TidesShape', 'earth_000101_230904_230611.bpc'),
+    'pck': os.path.join(ROOT, 'PlanetaryRings', 'data', 'pck00011.tpc'),
+    'gm': os.path.join(ROOT, 'PlanetaryRings', 'data', 'gm_de431.tpc'),
+}
+
+# Default directory of the Horizons tables
+CACHE_DIR = os.path.join(ROOT, 'TidesShape', 'Data', 'horizons')
+
+AU_KM = 149597870.700
+J2000_JD = 2451545.0
+
+_furnished = set()
+_skipped = set()
+
+
+def furnsh(*kernels):
+    """Furnish kernels (names of KERNELS or paths) that are not loaded yet in this process
+
+    Returns:
+        paths: list of the newly loaded kernels
+    """
+    loaded = []
+    for kernel in kernels:
+        path = os.path.abspath(KERNELS.get(kernel, kernel))
+        if path in _furnished:
+            continue
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            raise FileNotFoundError(f'Kernel {path} is missing or empty')
+        spy.furnsh(path)
+        _furnished.add(path)
+        loaded.append(path)
+    return loaded
+
+
+def load_default_kernels():
+    """Furnish every bundled kernel that is available, warning about the rest"""
+    for name in KERNELS:
+        if name in _skipped:
+            continue
+        try:
+            furnsh(name)
+        except (OSError, spy.utils.exceptions.SpiceyError) as error:
+            _skipped.add(name)
+            warnings.warn(f'Kernel {name} not loaded: {error}')
+    return sorted(_furnished)
+
+
+def unload_all():
+    """Unload every kernel (also those furnished outside this module)"""
+    spy.kclear()
+    _furnished.clear()
+    _skipped.clear()
+    body_constant.cache_clear()
+
+
+def is_loaded(kernel):
+    return os.path.abspath(KERNELS.get(kernel, kernel)) in _furnished
+
+
+def body_frame():
+    """Earth fixed frame: ITRF93 with the Earth orientation kernel, IAU_EARTH otherwise"""
+    load_default_kernels()
+    return 'ITRF93' if is_loaded('earth_orientation') else 'IAU_EARTH'
+
+
+@functools.lru_cache(maxsize=None)
+def body_constant(body, item):
+    """Constant of the kernel pool (e.g. body_constant('EARTH', 'RADII'), body_constant('599', 'GM'))
+
+    Returns a float for single values and a tuple otherwise, so the cached
+    value cannot be modified by the callers.
+    """
+    load_default_kernels()
+    dim, values = spy.bodvrd(str(body), item, 10)
+    return float(values[0]) if dim == 1 else tuple(float(v) for v in values[:dim])
+
+
+def et(times):
+    """Ephemeris times (TDB seconds past J2000) of UTC strings, datetimes or datetime64
+
+    Floats are taken as Julian dates in TDB.
+    """
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.number):
+        return (times.astype(float) - J2000_JD)*86400
+    furnsh('leapseconds')
+    if np.issubdtype(times.dtype, np.datetime64):
+        times = np.datetime_as_string(times)
+    flat = [str(t) for t in times.ravel()]
+    return np.array([spy.str2et(t) for t in flat]).reshape(times.shape)
+
+
+def jd(et_times):
+    """Julian dates (TDB) of ephemeris times"""
+    return np.asarray(et_times, dtype=float)/86400 + J2000_JD
+
+
+def rotation(et_times, frame_from=None, frame_to='J2000'):
+    """Rotation matrices between frames at an array of ephemeris times, shape (n, 3, 3)
+
+    By default from the Earth fixed frame (body_frame()) to J2000.
+    """
+    frame_from = frame_from or body_frame()
+    return np.array([spy.pxform(frame_from, frame_to, t) for t in np.atleast_1d(et_times)])
+
+
+class HorizonsCache():
+    """
+    On-disk cache of JPL Horizons tables
+
+    Every table is saved as a .npz file of its numeric columns, named by a
+    hash of (kind, body, location, epochs, refplane). Tables are also kept
+    in memory after the first read.
+
+    Args:
+        directory (str): directory of the tables
+        offline (bool): never query Horizons, missing tables raise LookupError
+    """
+    def __init__(self, directory=CACHE_DIR, offline=False):
+        self.directory = directory
+        self.offline = offline
+        self.data = {}
+        self.hits = self.misses = 0
+
+    def key(self, kind, body, location, epochs, refplane):
+        if isinstance(epochs, dict):
+            epochs = dict(sorted(epochs.items()))
+        else:
+            epochs = np.atleast_1d(epochs).tolist()
+        return json.dumps([kind, str(body), location, epochs, refplane])
+
+    def path(self, key):
+        kind, body = json.loads(key)[:2]
+        name = f"{kind}_{body}_{hashlib.sha1(key.encode()).hexdigest()[:16]}.npz"
+        return os.path.join(self.directory, name.replace('@', '').replace(' ', '_'))
+
+    def get(self, kind, body, location='@399', epochs=None, refplane='earth'):
+        """Columns {name: array} of a Horizons table
+
+        Args:
+            kind (str): 'vectors', 'elements' or 'ephemerides'
+            body (str or int): Horizons id (e.g. 301 or 'Moon')
+            location (str): center (e.g. '500@399' geocenter, '@599' Jupiter)
+            epochs: Julian date(s) or {'start': ..., 'stop': ..., 'step': ...}
+            refplane (str): 'earth' (J2000 equator) or 'ecliptic', for vectors and elements
+        """
+        key = self.key(kind, body, location, epochs, refplane)
+        if key in self.data:
+            self.hits += 1
+            return self.data[key]
+        path = self.path(key)
+        if os.path.isfile(path):
+            self.hits += 1
+            with np.load(path) as table:
+                columns = {name: table[name] for name in table.files if name != '__key__'}
+        else:
+            self.misses += 1
+            if self.offline:
+                raise LookupError(f'{kind} of {body} from {location} at {epochs} is not in '
+                                  f'{self.directory} and the cache is offline')
+            columns = self.query(kind, body, location, epochs, refplane)
+            self.store(key, columns)
+        self.data[key] = columns
+        return columns
+
+    def query(self, kind, body, location, epochs, refplane):
+        from astroquery.jplhorizons import Horizons
+        horizons = Horizons(id=body, location=location, epochs=epochs)
+        if kind == 'ephemerides':
+            table = horizons.ephemerides()
+        else:
+            table = getattr(horizons, kind)(refplane=refplane)
+        columns = {}
+        for name in table.colnames:
+            try:
+                columns[name] = np.asarray(table[name], dtype=float)
+            except (TypeError, ValueError):
+                pass
+        return columns
+
+    def store(self, key, columns):
+        os.makedirs(self.directory, exist_ok=True)
+        np.savez(self.path(key), __key__=key, **columns)
+
+    def put(self, kind, body, location, epochs, refplane, columns):
+        """Add a table obtained elsewhere (e.g. from a Horizons text export)"""
+        key = self.key(kind, body, location, epochs, refplane)
+        columns = {name: np.asarray(value, dtype=float) for name, value in columns.items()}
+        self.store(key, columns)
+        self.data[key] = columns
+
+    def info(self):
+        files = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        return dict(hits=self.hits, misses=self.misses, loaded=len(self.data),
+                    files=len([f for f in files if f.endswith('.npz')]), offline=self.offline)
+
+
+class Ephemeris():
+    """
+    States of bodies over arrays of epochs from cached Horizons vectors
+
+    Tables are requested by whole days (padded by one step) with a fixed
+    step, so runs over nearby epochs reuse the same table.
+
+    Args:
+        cache (HorizonsCache): tables, by default one in CACHE_DIR
+        step (str): step of the tables, e.g. '1h' or '10m'
+        offline (bool): with the default cache, never query Horizons
+    """
+    STEPS = {'m': 1/1440, 'h': 1/24, 'd': 1}
+
+    def __init__(self, cache=None, step='1h', offline=False):
+        self.cache = cache or HorizonsCache(offline=offline)
+        self.step = step
+        self.step_days = float(step[:-1])*self.STEPS[step[-1]]
+
+    def _epochs(self, jd_times):
+        start = np.floor(np.min(jd_times) - self.step_days - 0.5) + 0.5
+        stop = np.ceil(np.max(jd_times) + self.step_days - 0.5) + 0.5
+        return {'start': f'JD{start:.1f}', 'stop': f'JD{stop:.1f}', 'step': self.step}
+
+    def table(self, body, jd_times, location='500@399', refplane='earth'):
+        """Cached vectors table covering the epochs"""
+        return self.cache.get('vectors', body, location, self._epochs(jd_times), refplane)
+
+    def state(self, body, jd_times, location='500@399', refplane='earth'):
+        """Position [au] and velocity [au/day] of a body at Julian dates (TDB)
+
+        Returns:
+            r, v: arrays (n, 3)
+        """
+        jd_times = np.atleast_1d(np.asarray(jd_times, dtype=float))
+        table = self.table(body, jd_times, location, refplane)
+        t = table['datetime_jd']
+        R = np.stack([table['x'], table['y'], table['z']], axis=-1)
+        V = np.stack([table['vx'], table['vy'], table['vz']], axis=-1)
+        if jd_times.min() < t[0] or jd_times.max() > t[-1]:
+            raise ValueError('Epochs outside of the cached table')
+
+        i = np.clip(np.searchsorted(t, jd_times) - 1, 0, len(t) - 2)
+        h = (t[i+1] - t[i])[:, None]
+        s = ((jd_times - t[i])[:, None])/h
+        s2, s3 = s*s, s*s*s
+        r = ((2*s3 - 3*s2 + 1)*R[i] + (s3 - 2*s2 + s)*h*V[i]
+             + (-2*s3 + 3*s2)*R[i+1] + (s3 - s2)*h*V[i+1])
+        v = ((6*s2 - 6*s)*R[i]/h + (3*s2 - 4*s + 1)*V[i]
+             + (-6*s2 + 6*s)*R[i+1]/h + (3*s2 - 2*s)*V[i+1])
+        return r, v
+
+    def body_fixed(self, body, jd_times, frame=None):
+        """Geocentric positions [m] of a body in the Earth fixed frame, shape (n, 3)
+
+        Ready for tides.TidalField (frame defaults to body_frame()).
+        """
+        r, _ = self.state(body, jd_times)
+        M = rotation(et(np.atleast_1d(jd_times)), frame_from='J2000', frame_to=frame or body_frame())
+        return np.einsum('nij,nj->ni', M, r)*AU_KM*1e3
+
+    def elements(self, body, location, jd_time=None, refplane='ecliptic'):
+        """Osculating elements {name: value} of a body (e.g. 'a' in au) at one epoch"""
+        jd_time = J2000_JD if jd_time is None else float(jd_time)
+        table = self.cache.get('elements', body, location, jd_time, refplane)
+        return {name: value[0] for name, value in table.items()}
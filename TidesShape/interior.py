@@ -0,0 +1,189 @@
+"""
+Radial interior models (PREM) for rigidity and Love number estimates.
+
+The PREM file of TidesShape/Data (radius, density, vpv, vsv, Q_kappa, Q_mu,
+vph, vsh, eta per row, discontinuities as repeated radii) is parsed once
+into a (9, n) float array and saved next to it as a .npy cache, which is
+reused while it is newer than the .csv. InteriorModel interpolates the
+columns and the derived isotropic quantities (vs, vp, mu, kappa) over
+arrays of radii, piecewise linearly inside each layer. Radial integrals
+such as the mass and the moment of inertia are built from cumulative sums
+over the nodes, exact for the piecewise polynomial profiles with 3 point
+Gauss-Legendre quadrature, and computed once per (quantity, power).
+"""
+import os
+
+import numpy as np
+
+from tides import G
+
+PREM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data', 'PREM_ANISOTROPIC.csv')
+
+# Columns of the PREM file: name -> row of InteriorModel.data
+COLUMNS = {'radius': 0, 'density': 1, 'vpv': 2, 'vsv': 3, 'q_kappa': 4, 'q_mu': 5,
+           'vph': 6, 'vsh': 7, 'eta': 8}
+
+# 3 point Gauss-Legendre nodes and weights on [0, 1]
+_GAUSS_X = 0.5 + 0.5*np.array([-np.sqrt(3/5), 0, np.sqrt(3/5)])
+_GAUSS_W = np.array([5/18, 8/18, 5/18])
+
+
+def read_prem(path=PREM_PATH, cache=True):
+    r"""PREM columns as a (9, n) float array, from the .npy cache when it is up to date
+
+    Parameter
+    ---------
+    path: .csv file of the model
+    cache: read and write the binary cache path with extension .npy
+
+    Returns
+    -------
+    data: array (9, n), rows in the order of COLUMNS
+    """
+    cache_path = os.path.splitext(path)[0] + '.npy'
+    if cache and os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return np.load(cache_path)
+    data = np.ascontiguousarray(np.loadtxt(path, delimiter=',', ndmin=2).T)
+    if cache:
+        np.save(cache_path, data)
+    return data
+
+
+class InteriorModel():
+    r"""Spherically symmetric interior model
+
+    Parameter
+    ---------
+    data: array (9, n) with the rows of COLUMNS, radii increasing [m, kg/m^3, m/s]
+    """
+    def __init__(self, data):
+        self.data = np.asarray(data, dtype=float)
+        self.radius = self.data[COLUMNS['radius']]
+        self.R = self.radius[-1]
+        self._cumulative = {}
+
+    @classmethod
+    def load(cls, path=PREM_PATH, cache=True):
+        """Model of a PREM formatted file (see read_prem)"""
+        return cls(read_prem(path, cache))
+
+    def _locate(self, r):
+        # Interval of every radius, the upper layer at discontinuities
+        if np.any((r < 0) | (r > self.R)):
+            raise ValueError(f'Radii must be inside the model, 0 <= r <= {self.R}')
+        i = np.searchsorted(self.radius, r, side='right') - 1
+        i = np.clip(i, 0, len(self.radius) - 2)
+        width = self.radius[i+1] - self.radius[i]
+        s = np.divide(r - self.radius[i], width, out=np.zeros(np.shape(r)), where=width > 0)
+        return i, s
+
+    def _column(self, row, i, s):
+        return (1 - s)*row[i] + s*row[i+1]
+
+    def interpolate(self, name, r):
+        r"""Column or derived quantity at the radii r
+
+        Parameter
+        ---------
+        name: a column of COLUMNS or 'vs', 'vp' (Voigt averages), 'mu' (rigidity
+            rho vs^2), 'kappa' (bulk modulus)
+        r: array of radii inside the model, 0 <= r <= R (ValueError otherwise) [m]
+        """
+        r = np.asarray(r, dtype=float)
+        i, s = self._locate(r)
+        return self._value(name, i, s)
+
+    def _value(self, name, i, s):
+        if name in COLUMNS:
+            return self._column(self.data[COLUMNS[name]], i, s)
+        get = lambda column: self._column(self.data[COLUMNS[column]], i, s)
+        vs2 = (2*get('vsv')**2 + get('vsh')**2)/3
+        vp2 = (get('vpv')**2 + 4*get('vph')**2)/5
+        if name == 'vs':
+            return np.sqrt(vs2)
+        if name == 'vp':
+            return np.sqrt(vp2)
+        if name == 'mu':
+            return get('density')*vs2
+        if name == 'kappa':
+            return get('density')*(vp2 - 4*vs2/3)
+        raise ValueError(f'Not valid quantity {name}')
+
+    def density(self, r):
+        return self.interpolate('density', r)
+
+    def rigidity(self, r):
+        """Shear modulus mu = rho vs^2 [Pa]"""
+        return self.interpolate('mu', r)
+
+    def cumulative(self, name, power):
+        r"""Integrals of q(x) x^power from the center to every node (computed once)"""
+        key = (name, power)
+        if key not in self._cumulative:
+            r0, r1 = self.radius[:-1], self.radius[1:]
+            i = np.arange(len(r0))
+            total = 0
+            for x, w in zip(_GAUSS_X, _GAUSS_W):
+                total = total + w*self._value(name, i, x)*(r0 + x*(r1 - r0))**power
+            self._cumulative[key] = np.concatenate([[0], np.cumsum(total*(r1 - r0))])
+        return self._cumulative[key]
+
+    def integral(self, name, r, power=0):
+        r"""Integral of q(x) x^power dx from the center to the radii r
+
+        Equation
+        -------
+        :math:`\int_0^r q(x) x^p dx`
+        """
+        r = np.asarray(r, dtype=float)
+        i, s = self._locate(r)
+        r0 = self.radius[i]
+        partial = 0
+        for x, w in zip(_GAUSS_X, _GAUSS_W):
+            partial = partial + w*self._value(name, i, x*s)*(r0 + x*(r - r0))**power
+        return self.cumulative(name, power)[i] + partial*(r - r0)
+
+    def _inside(self, r):
+        # Radii above the surface enclose the whole model
+        return self.R if r is None else np.minimum(np.asarray(r, dtype=float), self.R)
+
+    def mass(self, r=None):
+        r"""Mass inside the radii r (the whole model by default, and above the surface) [kg]"""
+        return 4*np.pi*self.integral('density', self._inside(r), 2)
+
+    def moment_of_inertia(self, r=None):
+        r"""Moment of inertia of the spheres of radii r, that of the whole model above the
+        surface [kg m^2]"""
+        return 8*np.pi/3*self.integral('density', self._inside(r), 4)
+
+    def gravity(self, r):
+        r"""Gravitational acceleration G M(r)/r^2, G M/r^2 above the surface [m/s^2]"""
+        r = np.asarray(r, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(r > 0, G*self.mass(r)/r**2, 0.)
+
+    def mean(self, name, r=None):
+        r"""Volume average of a quantity inside the radii r"""
+        r = self.R if r is None else np.asarray(r, dtype=float)
+        return 3*self.integral(name, r, 2)/r**3
+
+    def effective_rigidity(self, r=None):
+        r"""Effective rigidity of the homogeneous body with the volume averaged
+        rigidity and density of the spheres of radii r (eq. 4.71)
+
+        Equation
+        -------
+        :math:`\tilde{\mu} = \frac{19 \bar{\mu}}{2 \bar{\rho} g R}`
+        """
+        r = self.R if r is None else np.asarray(r, dtype=float)
+        return 19*self.mean('mu', r)/(2*self.mean('density', r)*self.gravity(r)*r)
+
+    def love_numbers(self, r=None):
+        r"""Love numbers h2, k2 of the equivalent homogeneous elastic body
+
+        Equation
+        -------
+        :math:`h_2 = \frac{5/2}{1 + \tilde{\mu}}, k_2 = \frac{3/2}{1 + \tilde{\mu}}`
+        """
+        mu_ = self.effective_rigidity(r)
+        return 2.5/(1 + mu_), 1.5/(1 + mu_)
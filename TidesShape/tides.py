@@ -0,0 +1,332 @@
+"""
+Tidal potential, tide heights and Love number responses on (lat, lon, time) grids.
+
+The notebooks evaluate Tide(cosPsi(...)) point by point. Here the degree l
+tidal potential of a perturber of mass m_s at distance d,
+
+    V_l = -(G m_s/d) (R/d)^l P_l(cos psi),
+
+is expanded with the addition theorem
+
+    P_l(cos psi) = sum_m c_lm P_lm(sin lat) P_lm(sin lat_s) cos m(lon - lon_s)
+
+so that the Legendre functions P_lm(sin lat) and the cos(m lon), sin(m lon)
+of a grid are computed once (HarmonicBasis, kept in an LRU cache by
+get_basis) and every time step only needs the 2(l+1) coefficients of the
+sub-perturber point. A whole (time, lat, lon) field is then one matrix
+product per degree.
+
+Positions of the perturbers are given in the body fixed frame (x towards
+lon = 0 on the equator, z along the rotation axis), in meters.
+
+TidalField.body_tide and TidalField.ocean_tide use Love numbers,
+-h V/g and -(1 + k - h) V/g. The notebook instead computes the amplitudes
+A S_2 and A (T_2 - S_2) of the shallow ocean two layer model (eqs. 4.87,
+4.88). Those amplitudes are given by shallow_ocean_tides. For degree 2
+they equal the Love number forms with h_2 = A S_2/zeta and
+1 + k_2 - h_2 = A (T_2 - S_2)/zeta.
+"""
+from collections import OrderedDict
+from math import factorial
+
+import numpy as np
+from scipy.special import lpmv
+
+# Constants (SI, values of astropy.constants used in the notebooks)
+G = 6.6743e-11
+R_earth = 6378100.0
+m_earth = 5.972167867791379e24
+m_moon = 7.342e22
+a_em = 384400e3
+m_sun = 1.988409870698051e30
+au = 1.495978707e11
+omega_earth = 7.292115e-5  # Earth's rotation rate [rad/s]
+
+# Love numbers of the Earth {degree: value}
+LOVE_H = {2: 0.6078, 3: 0.292}
+LOVE_K = {2: 0.2980, 3: 0.093}
+
+
+def dseta(Rp, a, ms, mp):
+    r"""Amplitude of the equilibrium tide (eq. 4.13)
+
+    Equation
+    -------
+    :math:`\zeta = \frac{m_s}{m_p} \left(\frac{R_p}{a}\right)^3 R_p`
+    """
+    return Rp*(ms/mp)*(Rp/a)**3
+
+
+def g_f(Rp, mp):
+    r"""Surface gravity of the planet (eq. 4.14)"""
+    return G*mp/Rp**2
+
+
+def shallow_ocean_tides(zeta, mu_, sigma, rho):
+    r"""Amplitudes of the body tide A S_2 and of the ocean tide A (T_2 - S_2) of a
+    planet with a shallow ocean (eqs. 4.87 and 4.88)
+
+    The notebook's T_2 already returns the right side of eq. 4.87 divided
+    by A, so its ocean_tide(A, S2, T2) is lower than eq. 4.87 by A S_2.
+
+    Parameter
+    ---------
+    zeta: amplitude of the equilibrium tide (dseta) [m]
+    mu_: effective rigidity of the planet
+    sigma, rho: densities of the ocean and of the planet [kg/m^3]
+
+    Returns
+    -------
+    body, ocean: A S_2 and A (T_2 - S_2) [m]
+
+    Equation
+    -------
+    :math:`A S_2 = \frac{5}{2} \zeta \frac{1 - \sigma/\rho}{D}`,
+    :math:`A (T_2 - S_2) = \frac{\zeta \tilde{\mu}}{D}`,
+    :math:`D = 1 - \sigma/\rho + \tilde{\mu}(1 - 3\sigma/5\rho)`
+    """
+    D = 1 - sigma/rho + mu_*(1 - 3*sigma/(5*rho))
+    return 5/2*zeta*(1 - sigma/rho)/D, zeta*mu_/D
+
+
+def sub_point(positions):
+    r"""Latitude, longitude (degrees) and distance of body fixed positions
+
+    Parameter
+    ---------
+    positions: array (..., 3) of body fixed cartesian coordinates [m]
+
+    Returns
+    -------
+    lat, lon, d: arrays (...)
+    """
+    positions = np.asarray(positions, dtype=float)
+    d = np.linalg.norm(positions, axis=-1)
+    lat = np.degrees(np.arcsin(positions[..., 2]/d))
+    lon = np.degrees(np.arctan2(positions[..., 1], positions[..., 0]))
+    return lat, lon, d
+
+
+def body_fixed(positions, t, omega=omega_earth, lon0=0):
+    r"""Rotate inertial (equatorial) positions to the body fixed frame
+
+    Parameter
+    ---------
+    positions: array (n_t, 3) [m]
+    t: array (n_t,) times [s]
+    omega: rotation rate [rad/s]
+    lon0: longitude of the inertial x axis at t = 0 [degrees]
+
+    Returns
+    -------
+    positions: array (n_t, 3) in the body fixed frame
+    """
+    positions = np.asarray(positions, dtype=float)
+    angle = omega*np.asarray(t, dtype=float) + np.radians(lon0)
+    c, s = np.cos(angle), np.sin(angle)
+    return np.stack([c*positions[:, 0] + s*positions[:, 1],
+                     -s*positions[:, 0] + c*positions[:, 1],
+                     positions[:, 2]], axis=-1)
+
+
+def _legendre(l, x):
+    # Associated Legendre functions P_lm(x), m = 0..l, shape (l+1,) + x.shape
+    return np.stack([lpmv(m, l, x) for m in range(l + 1)])
+
+
+def _addition_weights(l):
+    # c_lm of the addition theorem for unnormalized P_lm
+    return np.array([1.0] + [2*factorial(l - m)/factorial(l + m) for m in range(1, l + 1)])
+
+
+class HarmonicBasis():
+    r"""Legendre and longitude harmonics of a (lat, lon) grid
+
+    Parameter
+    ---------
+    lat: array (n_lat,) latitudes [degrees]
+    lon: array (n_lon,) longitudes [degrees]
+    degrees: tuple of harmonic degrees
+
+    Attributes
+    ----------
+    P: {l: array (n_lat, l+1)} P_lm(sin lat) times the addition theorem weights
+    trig: {l: array (2(l+1), n_lon)} cos(m lon) stacked over sin(m lon)
+    """
+    def __init__(self, lat, lon, degrees=(2, 3)):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.degrees = tuple(degrees)
+        x = np.sin(np.radians(self.lat))
+        lam = np.radians(self.lon)
+        self.P = {l: (_legendre(l, x)*_addition_weights(l)[:, None]).T for l in self.degrees}
+        self.trig = {}
+        for l in self.degrees:
+            m = np.arange(l + 1)[:, None]
+            self.trig[l] = np.concatenate([np.cos(m*lam), np.sin(m*lam)])
+
+    @property
+    def shape(self):
+        return (len(self.lat), len(self.lon))
+
+    @property
+    def nbytes(self):
+        return sum(P.nbytes for P in self.P.values()) + sum(T.nbytes for T in self.trig.values())
+
+    def coefficients(self, l, lat_s, lon_s):
+        r"""Time dependent coefficients of degree l for sub-perturber points
+
+        Returns
+        -------
+        coefficients: array (n_t, 2(l+1)), P_lm(sin lat_s) cos(m lon_s) and
+            P_lm(sin lat_s) sin(m lon_s)
+        """
+        lat_s, lon_s = np.atleast_1d(lat_s), np.atleast_1d(lon_s)
+        P_s = _legendre(l, np.sin(np.radians(lat_s)))
+        m = np.arange(l + 1)[:, None]
+        lam = np.radians(lon_s)
+        return np.concatenate([P_s*np.cos(m*lam), P_s*np.sin(m*lam)]).T
+
+    def legendre_cos_psi(self, l, lat_s, lon_s):
+        r"""P_l(cos psi) on the grid for every sub-perturber point, shape (n_t, n_lat, n_lon)"""
+        C = self.coefficients(l, lat_s, lon_s)
+        n = l + 1
+        # (n_t, n_lat, 2n) x (2n, n_lon)
+        A = np.concatenate([C[:, None, :n]*self.P[l], C[:, None, n:]*self.P[l]], axis=-1)
+        return A @ self.trig[l]
+
+
+class BasisCache():
+    """
+    LRU cache of HarmonicBasis keyed on the grid and the degrees
+
+    Args:
+        max_bytes (int): memory budget, the least recently used bases are
+            evicted when the bases in the cache use more than max_bytes
+    """
+    def __init__(self, max_bytes=64*2**20):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def key(self, lat, lon, degrees):
+        return (np.asarray(lat, dtype=float).tobytes(), np.asarray(lon, dtype=float).tobytes(),
+                tuple(degrees))
+
+    def get(self, lat, lon, degrees):
+        key = self.key(lat, lon, degrees)
+        if key in self.data:
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+
+        self.misses += 1
+        basis = HarmonicBasis(lat, lon, degrees)
+        self.data[key] = basis
+        while self.nbytes > self.max_bytes and len(self.data) > 1:
+            self.data.popitem(last=False)
+            self.evictions += 1
+        return basis
+
+    @property
+    def nbytes(self):
+        return sum(basis.nbytes for basis in self.data.values())
+
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    size=len(self.data), nbytes=self.nbytes, max_bytes=self.max_bytes)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+# Cache shared by get_basis and TidalField
+cache = BasisCache()
+
+
+def configure_cache(max_bytes=64*2**20):
+    """Replace the shared cache (stored bases are dropped)"""
+    global cache
+    cache = BasisCache(max_bytes)
+    return cache
+
+
+def get_basis(lat, lon, degrees=(2, 3)):
+    """HarmonicBasis from the shared cache, computed on the first request"""
+    return cache.get(lat, lon, degrees)
+
+
+class TidalField():
+    r"""Tidal potential and tide heights of a planet on a (lat, lon) grid
+
+    Parameter
+    ---------
+    lat, lon: arrays of latitudes and longitudes [degrees]
+    mp: planet's mass [kg]
+    Rp: planet's radius [m]
+    degrees: harmonic degrees of the expansion (2 and 3)
+    h, k: Love numbers {degree: value}
+    """
+    def __init__(self, lat, lon, mp=m_earth, Rp=R_earth, degrees=(2, 3), h=LOVE_H, k=LOVE_K):
+        self.basis = get_basis(lat, lon, degrees)
+        self.mp = mp
+        self.Rp = Rp
+        self.g = g_f(Rp, mp)
+        self.h = h
+        self.k = k
+
+    def potential(self, ms, positions, degrees=None):
+        r"""Tide raising potential of a perturber (eq. 4.12 for l = 2)
+
+        Parameter
+        ---------
+        ms: perturber's mass [kg]
+        positions: array (n_t, 3) body fixed positions of the perturber [m]
+        degrees: degrees to include, by default all of the basis
+
+        Returns
+        -------
+        V: {l: array (n_t, n_lat, n_lon)} [J/kg]
+
+        Equation
+        -------
+        :math:`V_l = -\frac{G m_s}{d} \left(\frac{R_p}{d}\right)^l P_l(cos(\Psi))`
+        """
+        lat_s, lon_s, d = sub_point(np.atleast_2d(positions))
+        V = {}
+        for l in degrees or self.basis.degrees:
+            scale = -G*ms/d*(self.Rp/d)**l
+            V[l] = scale[:, None, None]*self.basis.legendre_cos_psi(l, lat_s, lon_s)
+        return V
+
+    def _combine(self, ms, positions, factors):
+        V = self.potential(ms, positions, list(factors))
+        return sum(factors[l]*V[l] for l in factors)
+
+    def total_potential(self, ms, positions):
+        """Sum of the degrees of potential, array (n_t, n_lat, n_lon) [J/kg]"""
+        return self._combine(ms, positions, {l: 1 for l in self.basis.degrees})
+
+    def equilibrium_tide(self, ms, positions):
+        r"""Height of the equilibrium tide -V/g on a rigid planet [m]"""
+        return self._combine(ms, positions, {l: -1/self.g for l in self.basis.degrees})
+
+    def body_tide(self, ms, positions):
+        r"""Radial displacement of the solid surface, -h_l V_l/g [m]
+
+        With Love numbers, not the A S_2 of the notebook (see shallow_ocean_tides)
+        """
+        return self._combine(ms, positions, {l: -self.h[l]/self.g for l in self.basis.degrees})
+
+    def ocean_tide(self, ms, positions):
+        r"""Equilibrium ocean tide relative to the sea floor, -(1 + k_l - h_l) V_l/g [m]
+
+        With Love numbers, not the A (T_2 - S_2) of the notebook (see shallow_ocean_tides)
+        """
+        return self._combine(ms, positions, {l: -(1 + self.k[l] - self.h[l])/self.g
+                                             for l in self.basis.degrees})
+
+    def potential_response(self, ms, positions):
+        r"""Potential of the deformed planet at its surface, k_l V_l [J/kg]"""
+        return self._combine(ms, positions, {l: self.k[l] for l in self.basis.degrees})